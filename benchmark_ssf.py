@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Benchmark of process_ssf on a synthetic SSF corpus.
+Distributed under the same license as process_ssf, the GNU General Public License version 3 or (at your option) any later version.
+"""
+import gc
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+import process_ssf
+
+# words, token types, chunk types and abbreviated features the synthetic tokens and chunks are made of
+benchmark_words = ("ram", "ghar", "jaa", "kitaab", "ne", "ko", "meM", "hE", "WA", "acchA", "laDakA", "pustaka")
+benchmark_token_types = ("NN", "NNP", "PSP", "VM", "VAUX", "JJ", "PRP", "CC")
+benchmark_chunk_types = ("NP", "VGF", "JJP", "CCP", "RBP", "NULL__VGF")
+benchmark_drel_labels = ("k1", "k2", "k7p", "r6", "pof", "ccof")
+
+# stages which can be measured, each one parses the whole synthetic corpus with one class, see benchmark_stage
+benchmark_stages = ("ssf_token", "ssf_chunk", "ssf_sentence", "ssf_document", "ssf_corpus", "ssf_corpus_compact", "ssf_corpus_lazy")
+
+
+# function to write a synthetic SSF corpus to a folder, the same settings and seed always give the same files
+# every outer chunk has chunks nested depth levels deep and every chunk has tokens_per_chunk tokens of its own
+# alternatives is the share of tokens with a second "|" separated feature structure and drel_density the share of chunks with a "drel"
+# with strict=True the sentences of every file are split into documents_per_file <document> tags, otherwise there are no document tags (lax)
+# returns the number of files, documents, sentences, chunks and tokens written
+def generate_ssf_corpus(ssf_corpus_folder, seed=0, files=4, sentences=4000, chunks_per_sentence=4, depth=1, tokens_per_chunk=3, alternatives=0.2, drel_density=0.5, strict=True, documents_per_file=10):
+    rng = random.Random(seed)
+    if not os.path.isdir(ssf_corpus_folder):
+        os.makedirs(ssf_corpus_folder)
+    counts = {"files": files, "documents": 0, "sentences": 0, "chunks": 0, "tokens": 0}
+    for file_number in range(files):
+        # the sentences are shared out as evenly as possible
+        file_sentences = sentences // files + (1 if file_number < sentences % files else 0)
+        file_documents = min(documents_per_file, file_sentences) if strict else 1
+        ssf_lines = []
+        for document_number in range(file_documents):
+            if strict:
+                ssf_lines.append("<document id='f%dd%d'>" % (file_number, document_number))
+                counts["documents"] += 1
+            document_sentences = file_sentences // file_documents + (1 if document_number < file_sentences % file_documents else 0)
+            for sentence_number in range(document_sentences):
+                ssf_lines += generate_ssf_sentence(rng, sentence_number + 1, chunks_per_sentence, depth, tokens_per_chunk, alternatives, drel_density)
+                counts["sentences"] += 1
+            if strict:
+                ssf_lines.append("</document>")
+        if not strict and file_sentences > 0:
+            counts["documents"] += 1
+        with open(os.path.join(ssf_corpus_folder, "part%03d.ssf" % file_number), "w") as ssf_corpus_file_handle:
+            ssf_corpus_file_handle.write("\n".join(ssf_lines) + "\n")
+    counts["chunks"] = counts["sentences"] * chunks_per_sentence * (depth + 1)
+    counts["tokens"] = counts["chunks"] * tokens_per_chunk
+    return counts
+
+
+# function to return the lines of one synthetic sentence, see generate_ssf_corpus
+def generate_ssf_sentence(rng, ssf_id, chunks_per_sentence, depth, tokens_per_chunk, alternatives, drel_density):
+    ssf_lines = ["<Sentence id='%d'>" % ssf_id, "0\t((\tSSF"]
+    # names of all the chunks of the sentence, the drel references are picked among them
+    chunk_names = []
+    for chunk_number in range(chunks_per_sentence):
+        chunk_names.append("C%d" % (chunk_number + 1))
+        for level in range(depth):
+            chunk_names.append("C%d_%d" % (chunk_number + 1, level + 1))
+    for chunk_number in range(chunks_per_sentence):
+        chunk_number_string = str(chunk_number + 1)
+        chunk_name = "C" + chunk_number_string
+        # open the outer chunk and the chunks nested in it
+        for level in range(depth + 1):
+            feature_structure = "<fs name='%s'" % chunk_name
+            if len(chunk_names) > 1 and rng.random() < drel_density:
+                reference = rng.choice(chunk_names)
+                while reference == chunk_name:
+                    reference = rng.choice(chunk_names)
+                feature_structure += " drel='%s:%s'" % (rng.choice(benchmark_drel_labels), reference)
+            ssf_lines.append("%s\t((\t%s\t%s>" % (chunk_number_string, rng.choice(benchmark_chunk_types), feature_structure))
+            for token_number in range(tokens_per_chunk):
+                ssf_lines.append(generate_ssf_token(rng, "%s.%d" % (chunk_number_string, token_number + 1), alternatives))
+            chunk_number_string += ".%d" % (tokens_per_chunk + 1)
+            chunk_name = "C%d_%d" % (chunk_number + 1, level + 1)
+        for level in range(depth + 1):
+            ssf_lines.append("\t))")
+    ssf_lines.append("\t))")
+    ssf_lines.append("</Sentence>")
+    return ssf_lines
+
+
+# function to return one synthetic token line, see generate_ssf_corpus
+def generate_ssf_token(rng, ssf_token_number, alternatives):
+    word = rng.choice(benchmark_words)
+    feature_structure = "<fs af='%s,n,%s,%s,3,%s,0,0' poslcat=\"NM\">" % (word, rng.choice("mf"), rng.choice(("sg", "pl")), rng.choice("do"))
+    if rng.random() < alternatives:
+        feature_structure += "|<fs af='%s,v,any,any,any,,0,0' vpos=tam1>" % word
+    return "%s\t%s\t%s\t%s" % (ssf_token_number, word, rng.choice(benchmark_token_types), feature_structure)
+
+
+# function to return the peak resident set size of this process in kilobytes
+def peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    if sys.platform == "darwin":
+        peak //= 1024
+    return peak
+
+
+# function to read what a stage parses from the corpus files, i.e. the token lines, chunk, sentence or document strings, or the folder itself
+def benchmark_stage_inputs(stage, ssf_corpus_folder, mode):
+    if stage.startswith("ssf_corpus"):
+        return [ssf_corpus_folder]
+    ssf_inputs = []
+    for ssf_corpus_file in sorted(os.listdir(ssf_corpus_folder)):
+        ssf_corpus_file_path = os.path.join(ssf_corpus_folder, ssf_corpus_file)
+        with open(ssf_corpus_file_path, "r") as ssf_corpus_file_handle:
+            ssf_corpus_text = ssf_corpus_file_handle.read()
+        if stage == "ssf_document":
+            if mode == "lax" and "<document" not in ssf_corpus_text:
+                ssf_inputs.append((ssf_corpus_text, ssf_corpus_file_path))
+            else:
+                ssf_inputs += [(ssf_document_string, ssf_corpus_file_path) for ssf_document_string in re.findall(r"<document[\w\W]*?</document>", ssf_corpus_text)]
+            continue
+        for span_type, ssf_sentence_string in process_ssf.scan_ssf_lines(ssf_corpus_text.splitlines(True), documents=False):
+            if span_type != "sentence":
+                continue
+            if stage == "ssf_sentence":
+                ssf_inputs.append(ssf_sentence_string)
+            elif stage == "ssf_chunk":
+                # the outer chunk strings, as split by ssf_sentence.get_chunk_strings
+                ssf_inputs += [ssf_chunk_string.rstrip("\n") for ssf_chunk_string in process_ssf.ssf_sentence.get_chunk_strings(None, ssf_sentence_string)]
+            else:
+                ssf_inputs += [line for line in ssf_sentence_string.split("\n") if "((" not in line and "))" not in line and not line.startswith("<")]
+    return ssf_inputs
+
+
+# function to measure one stage once, run in a fresh process so that its peak RSS is its own
+# returns the number of inputs parsed, the time taken and the peak RSS before and after parsing
+def benchmark_stage(benchmark_arguments):
+    stage, ssf_corpus_folder, mode, workers = benchmark_arguments
+    ssf_inputs = benchmark_stage_inputs(stage, ssf_corpus_folder, mode)
+    gc.collect()
+    rss_before = peak_rss()
+    start = time.perf_counter()
+    if stage == "ssf_token":
+        ssf_objects = [process_ssf.ssf_token(None, ssf_input) for ssf_input in ssf_inputs]
+    elif stage == "ssf_chunk":
+        ssf_objects = [process_ssf.ssf_chunk(None, ssf_input) for ssf_input in ssf_inputs]
+    elif stage == "ssf_sentence":
+        ssf_objects = [process_ssf.ssf_sentence(None, ssf_input) for ssf_input in ssf_inputs]
+    elif stage == "ssf_document":
+        ssf_objects = [process_ssf.ssf_document(None, ssf_document_string, ssf_corpus_file_path, mode) for ssf_document_string, ssf_corpus_file_path in ssf_inputs]
+    elif stage == "ssf_corpus_lazy":
+        # streaming, the sentences are not kept
+        ssf_objects = [sum(1 for ssf_sentence_object in process_ssf.ssf_corpus(ssf_corpus_folder, mode=mode, lazy=True).iter_sentences())]
+    else:
+        ssf_objects = [process_ssf.ssf_corpus(ssf_corpus_folder, mode=mode, workers=workers, compact=stage == "ssf_corpus_compact")]
+    seconds = time.perf_counter() - start
+    # the parsed objects are still alive here, so they count in the peak RSS
+    rss_after = peak_rss()
+    return len(ssf_inputs), seconds, rss_before, rss_after
+
+
+# function to run benchmark_stage in the process started for it by run_benchmark and send its result back through the connection
+# a plain (non daemonic) process is used, as the daemonic processes of a Pool cannot start the worker processes of ssf_corpus(workers=N)
+def benchmark_stage_process(benchmark_arguments, result_connection):
+    result_connection.send(benchmark_stage(benchmark_arguments))
+    result_connection.close()
+
+
+# function to run the benchmark on a corpus folder made by generate_ssf_corpus and return the results as a dict
+# every stage is run repeat times, each time in a new process, and the fastest run is reported
+def run_benchmark(ssf_corpus_folder, corpus_counts, mode="lax", stages=benchmark_stages, repeat=3, workers=None):
+    results = {}
+    # spawned processes do not inherit the memory (and the peak RSS) of this one
+    spawn_context = multiprocessing.get_context("spawn")
+    for stage in stages:
+        runs = []
+        for run in range(repeat):
+            receive_connection, send_connection = spawn_context.Pipe(duplex=False)
+            stage_process = spawn_context.Process(target=benchmark_stage_process, args=((stage, ssf_corpus_folder, mode, workers), send_connection))
+            stage_process.start()
+            # only the stage process holds the sending end now, so the pipe is closed if it dies without a result
+            send_connection.close()
+            try:
+                runs.append(receive_connection.recv())
+            except EOFError:
+                stage_process.join()
+                raise RuntimeError("benchmark stage %s failed with exit code %s" % (stage, stage_process.exitcode))
+            finally:
+                receive_connection.close()
+            stage_process.join()
+        items, seconds, rss_before, rss_after = min(runs, key=lambda stage_run: stage_run[1])
+        results[stage] = {
+            "items": items,
+            "seconds": seconds,
+            "tokens_per_second": corpus_counts["tokens"] / seconds if seconds > 0 else None,
+            "peak_rss_kb": rss_after,
+            "peak_rss_increase_kb": rss_after - rss_before,
+            "run_seconds": [stage_run[1] for stage_run in runs],
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark process_ssf on a synthetic SSF corpus, the results are written as JSON.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--sentences", type=int, default=4000)
+    parser.add_argument("--chunks-per-sentence", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=1, help="levels of chunks nested in every outer chunk")
+    parser.add_argument("--tokens-per-chunk", type=int, default=3)
+    parser.add_argument("--alternatives", type=float, default=0.2, help="share of tokens with a second | separated feature structure")
+    parser.add_argument("--drel-density", type=float, default=0.5, help="share of chunks with a drel")
+    parser.add_argument("--lax", action="store_true", help="write the sentences without document tags and read them in lax mode")
+    parser.add_argument("--documents-per-file", type=int, default=10)
+    parser.add_argument("--stages", default=",".join(benchmark_stages), help="comma separated stages out of " + ", ".join(benchmark_stages))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None, help="workers of the ssf_corpus stages")
+    parser.add_argument("--corpus-folder", default=None, help="keep the synthetic corpus in this folder instead of a temporary one")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to, standard output by default")
+    arguments = parser.parse_args(argv)
+    stages = [stage for stage in arguments.stages.split(",") if stage != ""]
+    for stage in stages:
+        if stage not in benchmark_stages:
+            parser.error("unknown stage %s" % stage)
+    mode = "lax" if arguments.lax else "strict"
+    settings = dict((name, getattr(arguments, name)) for name in ("seed", "files", "sentences", "chunks_per_sentence", "depth", "tokens_per_chunk", "alternatives", "drel_density", "documents_per_file"))
+    ssf_corpus_folder = arguments.corpus_folder if arguments.corpus_folder is not None else tempfile.mkdtemp(prefix="ssf_benchmark_")
+    try:
+        corpus_counts = generate_ssf_corpus(ssf_corpus_folder, strict=not arguments.lax, **settings)
+        corpus_counts["bytes"] = sum(os.path.getsize(os.path.join(ssf_corpus_folder, ssf_corpus_file)) for ssf_corpus_file in os.listdir(ssf_corpus_folder))
+        results = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": {"python": platform.python_version(), "implementation": platform.python_implementation(), "platform": platform.platform(), "cpus": multiprocessing.cpu_count(), "process_ssf_version": process_ssf.__version__, "ssf_cache_version": process_ssf.ssf_cache_version},
+            "settings": dict(settings, mode=mode, repeat=arguments.repeat, workers=arguments.workers),
+            "corpus": corpus_counts,
+            "stages": run_benchmark(ssf_corpus_folder, corpus_counts, mode, stages, arguments.repeat, arguments.workers),
+        }
+    finally:
+        if arguments.corpus_folder is None:
+            shutil.rmtree(ssf_corpus_folder, ignore_errors=True)
+    results_json = json.dumps(results, indent=2, sort_keys=True)
+    if arguments.output is None:
+        print(results_json)
+    else:
+        with open(arguments.output, "w") as output_file_handle:
+            output_file_handle.write(results_json + "\n")
+
+
+if __name__ == "__main__":
+    main()
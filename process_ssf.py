@@ -16,9 +16,27 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import gc
+import io
 import os
 import re
+import sys
+import json
+import mmap
+import time
+import array
+import pickle
+import weakref
+import hashlib
 import logging
+import functools
+import collections.abc
+import multiprocessing
+# numpy is only needed for the columnar token table (ssf_token_table)
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # authorship information
 __author__ = "Nikhilesh Bhatnagar"
@@ -29,227 +47,511 @@ __maintainer__ = "Nikhilesh Bhatnagar"
 __email__ = "nikhilesh.bhatnagar@research.iiit.ac.in"
 __status__ = "Prototype"
 # global initialization
+# nothing is logged (and no log file is opened) unless setup_logging is called or the application configures logging itself
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-# so that multiple handlers for the same file are made
 # remember, logging is a global object, so its not remade for the same name
 if len(logger.handlers) == 0:
-    handler = logging.FileHandler("mapper/logs/process_ssf.log")
-    handler.setLevel(logging.DEBUG)
+    logger.addHandler(logging.NullHandler())
+# counts of the parse events in this process, i.e. malformed tokens and rejected sentences by reason (see ssf_sentence.ssf_rejection)
+# they are counted instead of logging a warning for every one of them, the messages are only logged at DEBUG level
+# the events in worker processes are not counted here, see ssf_corpus_stats for the counts of a corpus
+ssf_event_counts = collections.Counter()
+# reasons why a sentence is rejected, see ssf_sentence.ssf_rejection
+ssf_rejection_reasons = ("bad_sentence_tag", "no_valid_chunk", "unresolved_drel", "ambiguous_drel")
+
+
+# function to log to a file, e.g. the messages about every malformed token and rejected sentence at DEBUG level
+# can be called again, a file handler is only added once for the same file
+def setup_logging(log_file_path="mapper/logs/process_ssf.log", level=logging.DEBUG):
+    for handler in logger.handlers:
+        if isinstance(handler, logging.FileHandler) and handler.baseFilename == os.path.abspath(log_file_path):
+            return
+    handler = logging.FileHandler(log_file_path)
+    handler.setLevel(level)
     formatter = logging.Formatter("%(asctime)s - %(name)s - %(funcName)s - %(lineno)d - %(levelname)s - %(message)s")
     handler.setFormatter(formatter)
     logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+# pattern of one feature of a feature structure, i.e. of a run of non-space characters
+# the groups are the name up to the first "=" and the value up to the next "=" (the rest is ignored), the value is None for a feature without "="
+ssf_feature_pattern = re.compile(r"(?=\S)([^\s=]*)(?:=([^\s=]*))?\S*")
+# how many distinct feature structure fields are kept parsed, see parse_ssf_feature_structures
+# the cache is made with this size at import, change it with set_ssf_feature_structure_cache_size and not by assigning it
+ssf_feature_structure_cache_size = 64 * 1024
+
+
+# function to parse the feature structure field of a token or chunk line, e.g. "<fs af='ghar,n,m,sg,3,o,0,0'>|<fs af='ghar,n,m,pl,3,o,0,0'>"
+# the field is split into its "|" alternatives and prefix_length characters ('<fs ' or, in broken SSF, '<') are shaved off the start of each and '>' off the end
+# returns (merged, alternatives, bad af count, bad feature count), where merged and every alternative are (features, af names) pairs, see ssf_feature_structure_dict
+#   alternatives has one such pair per alternative, merged is all of them with the later alternatives overwriting the values of the earlier ones
+#   an "af" feature without 8 values is counted and left out, an alternative with a feature without "=" is counted and cut short at that feature
+# with split_alternatives=False the field is read as one feature structure and with expand_af=False "af" is kept as a string like any other feature, as for chunks
+# the results are immutable and the same fields come up again and again in a treebank, so they are kept in a bounded LRU cache
+@functools.lru_cache(maxsize=ssf_feature_structure_cache_size)
+def parse_ssf_feature_structures(ssf_feature_structure_field, prefix_length=4, expand_af=True, split_alternatives=True):
+    merged_features = {}
+    alternatives = []
+    bad_af_count = bad_feature_count = 0
+    for ssf_feature_structure_string in ssf_feature_structure_field.split("|") if split_alternatives else (ssf_feature_structure_field,):
+        features = {}
+        for feature_match in ssf_feature_pattern.finditer(ssf_feature_structure_string[prefix_length:-1]):
+            feature, value = feature_match.group(1, 2)
+            # process abbreviated features
+            if expand_af and "af=" in feature_match.group(0):
+                # remove ' from the features for simplicity and consistency
+                # the 8 abbreviated features are kept as a tuple, which ssf_feature_structure_dict turns into the "af" dict
+                abbreviated_features = tuple(value.strip("'").strip("\"").split(","))
+                if len(abbreviated_features) != 8:
+                    bad_af_count += 1
+                    continue
+                features[feature] = abbreviated_features
+            # for other features
+            elif value is None:
+                bad_feature_count += 1
+                break
+            else:
+                # remove ' from the features for simplicity and consistency
+                features[feature] = value.strip("'").strip("\"")
+        merged_features.update(features)
+        alternatives.append(ssf_feature_structure_pair(features))
+    return ssf_feature_structure_pair(merged_features), tuple(alternatives), bad_af_count, bad_feature_count
+
+
+# function to change the number of distinct feature structure fields kept parsed, the fields parsed so far are dropped
+# worker processes started afterwards by fork get the new size, the ones started by spawn import the module again and get the default one
+def set_ssf_feature_structure_cache_size(cache_size):
+    global ssf_feature_structure_cache_size, parse_ssf_feature_structures
+    parse_ssf_feature_structures.cache_clear()
+    ssf_feature_structure_cache_size = cache_size
+    parse_ssf_feature_structures = functools.lru_cache(maxsize=cache_size)(parse_ssf_feature_structures.__wrapped__)
+
+
+# function to return the immutable (features, af names) pair of a parsed feature structure, i.e. its (feature, value) pairs and the features holding abbreviated features
+def ssf_feature_structure_pair(features):
+    return tuple(features.items()), tuple([feature for feature, value in features.items() if isinstance(value, tuple)])
+
+
+# function to make the feature structure dict of a token or chunk from a parsed (features, af names) pair, see parse_ssf_feature_structures
+# every token and chunk gets its own dicts as they can be changed, e.g. "drel" by ssf_sentence.resolve_inter_chunk_references
+def ssf_feature_structure_dict(ssf_feature_structure_pair):
+    features, abbreviated_feature_names = ssf_feature_structure_pair
+    ssf_feature_structure = dict(features)
+    # out of the 8 categories in af i.e. abbreviated features, 6 are known
+    # BEWARE so put the 6 known in dict and the rest with keys key7 and key8
+    for feature in abbreviated_feature_names:
+        ssf_feature_structure[feature] = dict(zip(ssf_abbreviated_feature_names, ssf_feature_structure[feature]))
+    return ssf_feature_structure
+
+
+# parsed form of a missing feature structure, see parse_ssf_feature_structures
+ssf_no_feature_structures = (((), ()), (), 0, 0)
 
 
 # class representing a SSF token with the feature structure, POS and ID information (in any case machine dynamic ID is provided in case of null IDs)
 class ssf_token(object):
     current_available_id = 0
 
-    def __init__(self, parent_chunk, ssf_token_string):
+    def __init__(self, parent_chunk, ssf_token_string, keep_alternatives=False):
         # assign parent link
         self.parent = parent_chunk
         # validity checks
         # token must be fully qualified with number, type and feature structure
-        try:
-            self.ssf_token_number = ssf_token_string.split("\n")[0].split("\t")[0]
-        except IndexError:
+        # the token line is split only once, the fields are indexed afterwards
+        ssf_token_fields = ssf_token_string.split("\n", 1)[0].split("\t")
+        self.ssf_token_number = ssf_token_fields[0]
+        if len(ssf_token_fields) < 2:
             self.ssf_token_value = ""
-            logger.warning("Token number not valid.")
+            ssf_event_counts["missing_token_value"] += 1
+            logger.debug("Token value not valid.")
             return
-        try:
-            self.ssf_token_value = ssf_token_string.split("\n")[0].split("\t")[1]
-        except IndexError:
+        self.ssf_token_value = ssf_token_fields[1]
+        if len(ssf_token_fields) < 3:
             self.ssf_token_value = ""
-            logger.warning("Token value not valid.")
+            ssf_event_counts["missing_token_type"] += 1
+            logger.debug("Token type not valid.")
             return
-        try:
-            self.ssf_token_type = ssf_token_string.split("\n")[0].split("\t")[2]
-        except IndexError:
-            self.ssf_token_value = ""
-            logger.warning("Token type not valid.")
-            return
-            # in some cases, more than one feature structure exist for tokens, so need to take care of that
+        self.ssf_token_type = ssf_token_fields[2]
+        # in some cases, more than one feature structure exist for tokens, so need to take care of that, see parse_ssf_feature_structures
         # slicing to shave off '<fs ' in the feature string at start and > at the end
         if "<fs" in ssf_token_string:
-            feature_structures = [feature_structure_string[4:-1].split() for feature_structure_string in ssf_token_string.split("\n")[0].split("\t")[3].split("|")]
+            ssf_feature_structures = parse_ssf_feature_structures(ssf_token_fields[3], 4)
         # broken SSF where fs starts like <af=
         elif "=" in ssf_token_string and "fs" not in ssf_token_string:
-            feature_structures = [feature_structure_string[1:-1].split() for feature_structure_string in ssf_token_string.split("\n")[0].split("\t")[3].split("|")]
+            ssf_feature_structures = parse_ssf_feature_structures(ssf_token_fields[3], 1)
         # even process SSF token with no feature structure
         else:
-            feature_structures = []
-        self.ssf_feature_structure = {}
-        # for every feature structure check existence of lhs value such as af and put the rhs string in the dict
-        for feature_structure in feature_structures:
-            for feature in feature_structure:
-                # process abbreviated features
-                if "af=" in feature:
-                    try:
-                        # remove ' from the features for simplicity and consistency
-                        # out of the 8 categories in af i.e. abbreviated features, 6 are known
-                        # BEWARE so put the 6 known in dict and the rest with keys key7 and key8
-                        root, category, gender, number, person, case, key7, key8 = feature.split("=")[1].strip("'").strip("\"").split(",")
-                        abbreviated_features = {"root": root, "category": category, "gender": gender, "number": number, "person": person, "case": case, "key7": key7, "key8": key8}
-                        self.ssf_feature_structure[feature.split("=")[0]] = abbreviated_features
-                    except ValueError:
-                        # currently bad "af" wont invalidate the whole token, but if you wish. you can do that here
-                        logger.warning("Bad feature structure, contains 9 values!")
-                    except IndexError:
-                        self.ssf_token_value = ""
-                        logger.warning("Token feature structure problem encountered!")
-                        break
-                # for other features
-                else:
-                    try:
-                        # remove ' from the features for simplicity and consistency
-                        self.ssf_feature_structure[feature.split("=")[0]] = feature.split("=")[1].strip("'").strip("\"")
-                    except IndexError:
-                        self.ssf_token_value = ""
-                        logger.warning("Token feature structure problem encountered!")
-                        break
-                        # Assign dynamic unique ID and update it
+            ssf_feature_structures = ssf_no_feature_structures
+        # the alternatives are merged into one dict, the later ones overwriting the values of the earlier ones
+        self.ssf_feature_structure = ssf_feature_structure_dict(ssf_feature_structures[0])
+        # with keep_alternatives=True the feature structure dict of every alternative is kept as well, in their order
+        self.ssf_feature_structure_alternatives = [ssf_feature_structure_dict(alternative) for alternative in ssf_feature_structures[1]] if keep_alternatives else None
+        if ssf_feature_structures[2] > 0:
+            # currently bad "af" wont invalidate the whole token, but if you wish. you can do that here
+            ssf_event_counts["bad_af_arity"] += ssf_feature_structures[2]
+            logger.debug("Bad feature structure, contains 9 values!")
+        if ssf_feature_structures[3] > 0:
+            self.ssf_token_value = ""
+            ssf_event_counts["bad_feature"] += ssf_feature_structures[3]
+            logger.debug("Token feature structure problem encountered!")
+        # Assign dynamic unique ID and update it
         self.id = ssf_token.current_available_id
         ssf_token.current_available_id += 1
 
 
+# function which builds the tokens and chunks in lines[first_line:last_line] of a chunk or a sentence in a single pass
+# nested chunks are tracked with an explicit stack of [chunk, elements] pairs instead of re-parsing the nested chunk strings
+# returns the valid elements directly under parent, i.e. tokens and chunks for a chunk and only chunks for a sentence
+# the validation rules are the same as before:
+#   a chunk with an invalid token of its own is emptied and the rest of it is skipped, an empty chunk is dropped
+#   lines outside of any chunk in a sentence make (invalid) single line chunks
+# chunk IDs are assigned when the chunk is closed, so nested chunks are numbered before the chunks containing them
+# with compact=True the elements are compact_ssf_chunk and compact_ssf_token objects
+# with keep_alternatives=True the tokens keep the feature structure of every "|" alternative, see ssf_token
+def build_ssf_elements(parent, lines, first_line, last_line, compact=False, keep_alternatives=False):
+    if compact:
+        token_class, chunk_class = compact_ssf_token, compact_ssf_chunk
+    else:
+        token_class, chunk_class = ssf_token, ssf_chunk
+    elements = []
+    # open chunks as [chunk, elements, token and chunk IDs available when it was opened], the elements of a chunk are None once an invalid token blows it up
+    stack = []
+    # nesting level inside a blown up chunk, these lines are skipped
+    skipped_nesting = 0
+    for line_number in range(first_line, last_line):
+        line = lines[line_number]
+        if "((" in line:
+            # an inner chunk has started
+            if skipped_nesting > 0 or (len(stack) > 0 and stack[-1][1] is None):
+                skipped_nesting += 1
+            else:
+                ssf_chunk_object = chunk_class.__new__(chunk_class)
+                ssf_chunk_object.start_chunk(stack[-1][0] if len(stack) > 0 else parent, line)
+                stack.append([ssf_chunk_object, [], ssf_token.current_available_id, ssf_chunk.current_available_id])
+        elif "))" in line:
+            # current chunk has completed
+            if skipped_nesting > 0:
+                skipped_nesting -= 1
+            elif len(stack) > 0:
+                ssf_chunk_object, ssf_chunk_elements = stack.pop()[:2]
+                if ssf_chunk_elements is not None:
+                    ssf_chunk_object.ssf_tokens_and_chunks = ssf_chunk_elements
+                ssf_chunk_object.finish_chunk()
+                # if the chunk has chunks or tokens, it is valid
+                if len(ssf_chunk_object.ssf_tokens_and_chunks) > 0:
+                    if len(stack) == 0:
+                        elements.append(ssf_chunk_object)
+                    elif stack[-1][1] is not None:
+                        stack[-1][1].append(ssf_chunk_object)
+        elif skipped_nesting == 0:
+            # it is a token
+            if len(stack) > 0:
+                # token in nested chunk
+                if stack[-1][1] is not None:
+                    ssf_token_object = token_class(stack[-1][0], line, keep_alternatives)
+                    # if the token has a token and the feature structure, it is valid
+                    if ssf_token_object.ssf_token_value == "":
+                        # blow up the stack!!
+                        stack[-1][1] = None
+                    else:
+                        stack[-1][1].append(ssf_token_object)
+            elif isinstance(parent, ssf_chunk_types):
+                # token in main chunk
+                ssf_token_object = token_class(parent, line, keep_alternatives)
+                # for tokens, validation is over equality as this is the ground step which blows up to the sentence level
+                if ssf_token_object.ssf_token_value == "":
+                    # blow up the stack!!
+                    return []
+                elements.append(ssf_token_object)
+            else:
+                # not in any chunk of the sentence, such a line is a chunk without tokens and hence never valid
+                chunk_class(parent, line)
+    # a chunk which is never closed was never made, so give back the IDs used inside it
+    if len(stack) > 0:
+        ssf_token.current_available_id, ssf_chunk.current_available_id = stack[0][2:]
+    return elements
+
+
 # class representing a SSF chunk with the feature structure, chunk tag and ID information (in any case machine dynamic ID is provided in case of null IDs)
 # BEWARE SSF tagged chunks are ignored.
 class ssf_chunk(object):
     current_available_id = 0
 
-    def __init__(self, parent_sentence, ssf_chunk_string):
+    def __init__(self, parent_sentence, ssf_chunk_string, keep_alternatives=False):
+        ssf_chunk_lines = ssf_chunk_string.split("\n")
+        self.start_chunk(parent_sentence, ssf_chunk_lines[0])
+        # remove first and last line so that main chunk is not counted as nested chunk
+        self.ssf_tokens_and_chunks = build_ssf_elements(self, ssf_chunk_lines, 1, len(ssf_chunk_lines) - 1, keep_alternatives=keep_alternatives)
+        self.finish_chunk()
+
+    # function to set up the chunk from its opening line, used directly by build_ssf_elements which adds the tokens and nested chunks
+    def start_chunk(self, parent_sentence, ssf_chunk_line):
         # setup parent link
         self.parent = parent_sentence
         self.ssf_tokens_and_chunks = []
+        ssf_chunk_fields = ssf_chunk_line.split("\t")
         # not converting ssf_chunk_number to integer because we can have stuff like 1.2.3
-        self.ssf_chunk_number = ssf_chunk_string.split("\n")[0].split("\t")[0]
-        self.ssf_chunk_type = ssf_chunk_string.split("\n")[0].split("\t")[2]
-        # remove '<fs ' and '>' from the feature structure string
+        self.ssf_chunk_number = ssf_chunk_fields[0]
+        self.ssf_chunk_type = ssf_chunk_fields[2]
+        # remove '<fs ' and '>' from the feature structure string, see parse_ssf_feature_structures
+        # unlike for a token, the whole field is one feature structure and all the values (also "af") are kept as strings
         # process SSF chunks with no feature structure. They sometimes occur with well made chunks as well owing to inconsistent annotation.
-        try:
-            feature_structures = ssf_chunk_string.split("\n")[0].split("\t")[3][4:-1].split()
-        except IndexError:
-            feature_structures = []
-        self.ssf_feature_structure = {}
-        for feature_structure in feature_structures:
-            # remove ' from the features for simplicity and consistency
-            self.ssf_feature_structure[feature_structure.split("=")[0]] = feature_structure.split("=")[1].strip("'").strip("\"")
-            # checks for level of nesting in the loop below
-        nesting = 0
-        # current chunk consists of lines in the ssf_chunk_string which encapsulates the current inner or outer chunk
-        current_chunk = ""
-        # remove first and last line so that main chunk is not counted as nested chunk
-        for line in ssf_chunk_string.split("\n")[1:-1]:
-            if "((" in line:
-                # an inner chunk has started (since we already removed the top line containing '((')
-                current_chunk += line + "\n"
-                nesting += 1
-            elif "))" in line:
-                # current chunk has completed
-                current_chunk += line + "\n"
-                nesting -= 1
-                # check if it was nested or not
-                if nesting == 0:
-                    # remove trailing \n from current_chunk
-                    # this constructor is a recursive call for the nested chunks
-                    ssf_chunk_object = ssf_chunk(self, current_chunk[:-1])
-                    # if the chunk has chunks or tokens, it is valid
-                    if len(ssf_chunk_object.ssf_tokens_and_chunks) > 0:
-                        self.ssf_tokens_and_chunks.append(ssf_chunk_object)
-                        # reset current_chunk
-                    current_chunk = ""
-            else:
-                # it is a token
-                # check if the token in a nested chunk or in the main chunk string for this object
-                if nesting == 0:
-                    # token in main chunk
-                    ssf_token_object = ssf_token(self, line)
-                    # if the token has a token and the feature structure, it is valid
-                    # for tokens, validation is over equality as this is the ground step which blows up to the sentence level
-                    if ssf_token_object.ssf_token_value == "":
-                        # blow up the stack!!
-                        self.ssf_tokens_and_chunks = []
-                        break
-                    else:
-                        self.ssf_tokens_and_chunks.append(ssf_token_object)
-                else:
-                    # token in nested chunk
-                    current_chunk += line + "\n"
-                    # assign dynamic unique ID and update it
+        if len(ssf_chunk_fields) > 3:
+            ssf_feature_structures = parse_ssf_feature_structures(ssf_chunk_fields[3], 4, False, False)
+        else:
+            ssf_feature_structures = ssf_no_feature_structures
+        self.ssf_feature_structure = ssf_feature_structure_dict(ssf_feature_structures[0])
+        # a bad feature does not invalidate the chunk, the rest of its feature structure is left out
+        if ssf_feature_structures[3] > 0:
+            ssf_event_counts["bad_feature"] += ssf_feature_structures[3]
+            logger.debug("Chunk feature structure problem encountered!")
+
+    # function to close a chunk once all its tokens and nested chunks have been added
+    def finish_chunk(self):
+        # assign dynamic unique ID and update it
         self.id = ssf_chunk.current_available_id
         ssf_chunk.current_available_id += 1
 
     # this function return a list of ssf_token objects in this chunk
     def tokens(self):
-        token_list = []
-        for element in self.ssf_tokens_and_chunks:
-            if type(element) == ssf_token:
-                token_list.append(element)
-            # recursively get all tokens from nested chunks as well
+        return list(self.iter_tokens())
+
+    # generator over the ssf_token objects in this chunk, including the ones in nested chunks, from left to right
+    # an explicit stack of element iterators is used, so no list is made for the nested chunks
+    def iter_tokens(self):
+        stack = [iter(self.ssf_tokens_and_chunks)]
+        while len(stack) > 0:
+            for element in stack[-1]:
+                if isinstance(element, ssf_token_types):
+                    yield element
+                else:
+                    # continue with the nested chunk, then come back to this one
+                    stack.append(iter(element.ssf_tokens_and_chunks))
+                    break
             else:
-                token_list += element.tokens()
-        return token_list
+                stack.pop()
+
+    # function to return the ssf_sentence object this chunk is in, None if the chunk is not in a sentence
+    def sentence(self):
+        parent = self.parent
+        while isinstance(parent, ssf_chunk_types):
+            parent = parent.parent
+        if isinstance(parent, ssf_sentence):
+            return parent
+        return None
+
+    # function to return the tokens of this chunk as a tuple which is kept by the sentence until its cache is invalidated
+    # see ssf_sentence.cached_tokens
+    def cached_tokens(self):
+        ssf_sentence_object = self.sentence()
+        if ssf_sentence_object is None:
+            return tuple(self.iter_tokens())
+        return ssf_sentence_object.cached_chunk_tokens(self)
+
+    # function to return (start, end) of the tokens of this chunk in the cached tokens of its sentence, so that
+    # sentence.cached_tokens()[start:end] are the tokens of this chunk, None if the chunk is not in a sentence
+    def token_span(self):
+        ssf_sentence_object = self.sentence()
+        if ssf_sentence_object is None:
+            return None
+        return ssf_sentence_object.token_span(self)
+
+    # function to drop the cached tokens, chunks and token spans of the sentence of this chunk, see ssf_sentence.invalidate_cache
+    def invalidate_cache(self):
+        ssf_sentence_object = self.sentence()
+        if ssf_sentence_object is not None:
+            ssf_sentence_object.invalidate_cache()
+
+
+# names of the 8 abbreviated features in "af", in the order they are written in SSF
+ssf_abbreviated_feature_names = ("root", "category", "gender", "number", "person", "case", "key7", "key8")
+ssf_abbreviated_feature_positions = dict((name, position) for position, name in enumerate(ssf_abbreviated_feature_names))
+
+
+# class representing the abbreviated features ("af") of a token in compact storage mode
+# it is a read only mapping with the same keys as the "af" dict of ssf_token, backed by a tuple of interned strings
+# equal "af" values share the same object, see compact_abbreviated_features
+class ssf_abbreviated_features(collections.abc.Mapping):
+    __slots__ = ("ssf_values", "__weakref__")
+
+    def __init__(self, ssf_values):
+        self.ssf_values = ssf_values
+
+    def __getitem__(self, name):
+        try:
+            return self.ssf_values[ssf_abbreviated_feature_positions[name]]
+        except KeyError:
+            raise KeyError(name)
+
+    def __iter__(self):
+        return iter(ssf_abbreviated_feature_names)
+
+    def __len__(self):
+        return len(ssf_abbreviated_feature_names)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+# shared ssf_abbreviated_features objects by their values
+# the cache only holds weak references, so an object is dropped from it once no token of any corpus uses it any more
+compact_abbreviated_features_cache = weakref.WeakValueDictionary()
+
+
+# function to return the shared ssf_abbreviated_features object for an "af" dict
+def compact_abbreviated_features(abbreviated_features):
+    ssf_values = tuple([sys.intern(abbreviated_features[name]) for name in ssf_abbreviated_feature_names])
+    compact_object = compact_abbreviated_features_cache.get(ssf_values)
+    if compact_object is None:
+        compact_object = compact_abbreviated_features_cache[ssf_values] = ssf_abbreviated_features(ssf_values)
+    return compact_object
+
+
+# function to intern the keys and string values of a feature structure dict, "af" dicts are replaced by shared ssf_abbreviated_features objects
+def compact_feature_structure(ssf_feature_structure):
+    compact_dict = {}
+    for feature, value in ssf_feature_structure.items():
+        if isinstance(value, dict):
+            compact_dict[sys.intern(feature)] = compact_abbreviated_features(value)
+        else:
+            compact_dict[sys.intern(feature)] = sys.intern(value)
+    return compact_dict
+
+
+# class representing a SSF token in compact storage mode
+# same attributes, validation and IDs as ssf_token, but stored in __slots__ with interned strings and a shared "af" object instead of a dict
+# BEWARE the "af" values are read only and no other attributes can be set on the token
+class compact_ssf_token(object):
+    __slots__ = ("parent", "ssf_token_number", "ssf_token_value", "ssf_token_type", "ssf_feature_structure", "ssf_feature_structure_alternatives", "id")
+
+    def __init__(self, parent_chunk, ssf_token_string, keep_alternatives=False):
+        ssf_token.__init__(self, parent_chunk, ssf_token_string, keep_alternatives)
+        # invalid tokens are dropped anyway
+        if self.ssf_token_value != "":
+            self.ssf_token_number = sys.intern(self.ssf_token_number)
+            self.ssf_token_value = sys.intern(self.ssf_token_value)
+            self.ssf_token_type = sys.intern(self.ssf_token_type)
+            self.ssf_feature_structure = compact_feature_structure(self.ssf_feature_structure)
+            if self.ssf_feature_structure_alternatives is not None:
+                self.ssf_feature_structure_alternatives = [compact_feature_structure(alternative) for alternative in self.ssf_feature_structure_alternatives]
+
+
+# class representing a SSF chunk in compact storage mode
+# same attributes, methods, validation and IDs as ssf_chunk, but stored in __slots__ with interned strings
+class compact_ssf_chunk(object):
+    __slots__ = ("parent", "ssf_tokens_and_chunks", "ssf_chunk_number", "ssf_chunk_type", "ssf_feature_structure", "id")
+
+    def __init__(self, parent_sentence, ssf_chunk_string, keep_alternatives=False):
+        ssf_chunk_lines = ssf_chunk_string.split("\n")
+        self.start_chunk(parent_sentence, ssf_chunk_lines[0])
+        self.ssf_tokens_and_chunks = build_ssf_elements(self, ssf_chunk_lines, 1, len(ssf_chunk_lines) - 1, compact=True, keep_alternatives=keep_alternatives)
+        self.finish_chunk()
+
+    def start_chunk(self, parent_sentence, ssf_chunk_line):
+        ssf_chunk.start_chunk(self, parent_sentence, ssf_chunk_line)
+        self.ssf_chunk_number = sys.intern(self.ssf_chunk_number)
+        self.ssf_chunk_type = sys.intern(self.ssf_chunk_type)
+        self.ssf_feature_structure = compact_feature_structure(self.ssf_feature_structure)
+
+    finish_chunk = ssf_chunk.finish_chunk
+    tokens = ssf_chunk.tokens
+    iter_tokens = ssf_chunk.iter_tokens
+    sentence = ssf_chunk.sentence
+    cached_tokens = ssf_chunk.cached_tokens
+    token_span = ssf_chunk.token_span
+    invalidate_cache = ssf_chunk.invalidate_cache
+
+
+# token and chunk classes of both storage modes, for type checks
+ssf_token_types = (ssf_token, compact_ssf_token)
+ssf_chunk_types = (ssf_chunk, compact_ssf_chunk)
 
 
 # class representing a SSF sentence with ID information (in any case machine dynamic ID is provided in case of null IDs)
+# with compact=True its chunks and tokens are made in compact storage mode, see compact_ssf_token
+# with keep_alternatives=True its tokens keep the feature structure of every "|" alternative, see ssf_token
 class ssf_sentence(object):
     current_available_id = 0
+    # (packed file, number of the sentence in it) of a sentence read from a cache file until its chunks are first used, see pack_ssf_documents
+    # vars() of such a sentence has this entry in place of ssf_chunks and ssf_chunk_names
+    ssf_packed_chunks = None
 
-    def __init__(self, parent_document, ssf_sentence_string):
+    def __init__(self, parent_document, ssf_sentence_string, compact=False, keep_alternatives=False):
         # make parent object link
         self.parent = parent_document
         # list of all ssf_chunk objects in the sentence
         self.ssf_chunks = []
+        # "name" -> chunk index of the chunks in the sentence, see resolve_inter_chunk_references
+        self.ssf_chunk_names = {}
+        # why the sentence is not valid, as a (reason, explanation) pair, None for a valid sentence
+        self.ssf_rejection = None
+        # cached tokens, chunks and token spans of the sentence, built when first asked for, see cached_views
+        self.ssf_cached_views = None
         # validate the sentence structure also
         # like with documents, did not encounter any other string than id=, maybe it needs to be changed in the future
-        # replaced [\w\W]+ with [\w\W]* in regex, if unexpected problems arise, switch back
-        try:
-            ssf_sentence_id, ssf_sentence_inner = re.findall("<Sentence id=(?:\"|')(.*?)(?:\"|')>([\w\W]*?</)Sentence>", ssf_sentence_string)[0]
-        except IndexError:
+        # the header is matched on its own and the closing tag is looked up after it, instead of matching the whole sentence with a regex
+        ssf_sentence_match = re.search("<Sentence id=(?:\"|')(.*?)(?:\"|')>", ssf_sentence_string)
+        if ssf_sentence_match is None or ssf_sentence_string.find("</Sentence>", ssf_sentence_match.end()) == -1:
+            self.ssf_rejection = ("bad_sentence_tag", "no <Sentence id=...> ... </Sentence> in the sentence string")
             return
-            # ID given in SSF format, could be null also
-        self.ssf_id = ssf_sentence_id
-        # send the chunk so that it can be validated and the object made; the regex is used to ensure that only one chunk reaches the ssf_chunk constructor
-        # only outermost chunk is selected; nested chunks deferred to ssf_chunk class because tokens and chunks can be mixed in a nested chunk
-        # FIXED chunks with tokens after nested chunks are processed correctly
+        # ID given in SSF format, could be null also
+        self.ssf_id = ssf_sentence_match.group(1)
+        # the chunks are built in one pass over the lines between the <Sentence> tags, see build_ssf_elements
         # regex cannot do bracket matching
-        for ssf_chunk_string in self.get_chunk_strings(ssf_sentence_string):
-            ssf_chunk_object = ssf_chunk(self, ssf_chunk_string)
-            # if the chunk has chunks or tokens, it is valid.
-            if len(ssf_chunk_object.ssf_tokens_and_chunks) > 0:
-                self.ssf_chunks.append(ssf_chunk_object)
-                # Now, the inter chunk references such as in "drel" should be checked.
+        ssf_sentence_lines = ssf_sentence_string.split("\n")
+        first_line, last_line = 1, len(ssf_sentence_lines) - 1
+        # remove SSF chunk
+        # BEWARE SSF chunk (normally chunk 0) is removed
+        if first_line < last_line and "SSF" in ssf_sentence_lines[first_line]:
+            first_line, last_line = first_line + 1, last_line - 1
+        self.ssf_chunks = build_ssf_elements(self, ssf_sentence_lines, first_line, last_line, compact, keep_alternatives)
+        # Now, the inter chunk references such as in "drel" should be checked.
         if not self.resolve_inter_chunk_references():
             self.ssf_chunks = []
+        elif len(self.ssf_chunks) == 0:
+            self.ssf_rejection = ("no_valid_chunk", "every chunk of the sentence is empty or has an invalid token")
             # assign dynamic unique ID and update it
         self.id = ssf_sentence.current_available_id
         ssf_sentence.current_available_id += 1
 
     # function to check and update the feature structure for internal chunk references, such as "drel".
-    # returns boolean value True if all references are resolved and updated and False otherwise.
+    # returns boolean value True if all references are resolved and updated and False otherwise, with the reason in ssf_rejection.
+    # a single walk over the chunks builds the "name" -> chunk index (kept in ssf_chunk_names) and collects the chunks with a "drel"
+    # a name given to more than one chunk is left out of the index, it is only an error if a "drel" refers to it
     def resolve_inter_chunk_references(self):
-        for chunk in self.chunks(mode="all"):
-            # check for "drel" references
-            if "drel" in chunk.ssf_feature_structure:
-                drel, reference = chunk.ssf_feature_structure["drel"].split(":")
-                # now check if a chunk with the same reference "name" exists in the sentence
-                reference_chunks = []
-                for reference_chunk in self.chunks(mode="all"):
-                    try:
-                        if reference_chunk.ssf_feature_structure["name"] == reference:
-                            reference_chunks.append(reference_chunk)
-                    except KeyError:
-                        # no logger warning because not all chunks have "name", just the ones which are needed
-                        pass
-                        # The correct reference should be unique
-                if len(reference_chunks) == 1:
-                    # Set "drel" with label and reference.
-                    chunk.ssf_feature_structure["drel"] = (drel, reference_chunks[0])
+        self.ssf_chunk_names = {}
+        duplicate_names = set()
+        drel_chunks = []
+        for chunk in self.iter_chunks(mode="all"):
+            chunk_feature_structure = chunk.ssf_feature_structure
+            # no logger warning when there is no "name" because not all chunks have "name", just the ones which are needed
+            if "name" in chunk_feature_structure:
+                name = chunk_feature_structure["name"]
+                if name in self.ssf_chunk_names or name in duplicate_names:
+                    duplicate_names.add(name)
+                    self.ssf_chunk_names.pop(name, None)
                 else:
-                    return False
+                    self.ssf_chunk_names[name] = chunk
+            # check for "drel" references
+            if "drel" in chunk_feature_structure:
+                drel_chunks.append(chunk)
+        for chunk in drel_chunks:
+            drel, reference = chunk.ssf_feature_structure["drel"].split(":")
+            # The correct reference should be unique
+            if reference in self.ssf_chunk_names:
+                # Set "drel" with label and reference.
+                chunk.ssf_feature_structure["drel"] = (drel, self.ssf_chunk_names[reference])
+            elif reference in duplicate_names:
+                self.ssf_rejection = ("ambiguous_drel", "drel '%s:%s' of chunk %s refers to a name given to more than one chunk" % (drel, reference, chunk.ssf_chunk_number))
+                return False
+            else:
+                self.ssf_rejection = ("unresolved_drel", "drel '%s:%s' of chunk %s refers to a name no chunk has" % (drel, reference, chunk.ssf_chunk_number))
+                return False
         return True
 
     # fuction to return outermost chunk strings with brackets
+    # not used by the constructor any more (see build_ssf_elements), kept for callers which need the chunk strings themselves
     def get_chunk_strings(self, sentence_string):
         # remove <Sentence> tags
         sentence_string = "\n".join(sentence_string.split("\n")[1:-1])
@@ -278,41 +580,115 @@ class ssf_sentence(object):
 
     # function to return "outer", "inner" or at token level and "all" chunks in this sentence
     def chunks(self, mode="outer"):
-        chunk_list = []
+        return list(self.iter_chunks(mode))
+
+    # generator over the "outer", "inner" or at token level and "all" chunks in this sentence
+    # nested chunks come before the chunk they are in and otherwise the chunks are in token order i.e. from left to right in the sentence
+    def iter_chunks(self, mode="outer"):
         # outer mode when level 1 i.e. just below SSF chunk
-        chunk_list += self.ssf_chunks
-        if mode == "inner" or mode == "all":
-            # set stack and completed list
-            temp_chunk_list = chunk_list
-            chunk_list = []
-            while len(temp_chunk_list) > 0:
-                # get all nested chunks
-                sub_chunks = [sub_chunk for sub_chunk in temp_chunk_list[-1].ssf_tokens_and_chunks if type(sub_chunk) == ssf_chunk]
-                if mode == "inner":
-                    # only append when we have the innermost chunk
-                    if len(sub_chunks) == 0:
-                        chunk_list.append(temp_chunk_list[-1])
-                elif mode == "all":
-                    # append all chunks in the chunk tree
-                    chunk_list.append(temp_chunk_list[-1])
-                temp_chunk_list.pop()
-                # append the new chunks to the stack
-                temp_chunk_list += sub_chunks
-                # reverse so that the chunks are returned in token order i.e. from left to right in the sentence
-            chunk_list.reverse()
-        return chunk_list
+        if mode != "inner" and mode != "all":
+            for chunk in self.ssf_chunks:
+                yield chunk
+            return
+        # stack of [chunk, iterator over its elements, whether it has nested chunks], the sentence itself is at the bottom
+        stack = [[None, iter(self.ssf_chunks), True]]
+        while len(stack) > 0:
+            frame = stack[-1]
+            for element in frame[1]:
+                if isinstance(element, ssf_chunk_types):
+                    frame[2] = True
+                    stack.append([element, iter(element.ssf_tokens_and_chunks), False])
+                    break
+            else:
+                # all nested chunks are done
+                stack.pop()
+                # only the innermost chunks in "inner" mode
+                if frame[0] is not None and (mode == "all" or not frame[2]):
+                    yield frame[0]
+
+    # generator over the ssf_token objects in this sentence from left to right
+    def iter_tokens(self):
+        for chunk in self.ssf_chunks:
+            for token in chunk.iter_tokens():
+                yield token
+
+    # function to build the cached views of the sentence in one walk over the chunk tree, or return them when already built
+    # the views are kept until invalidate_cache is called, which has to be done after changing the chunks or tokens of the sentence
+    def cached_views(self):
+        if self.ssf_cached_views is None:
+            token_list = []
+            # chunk -> (start, end) of its tokens in token_list
+            token_spans = {}
+            stack = [[None, iter(self.ssf_chunks), 0]]
+            while len(stack) > 0:
+                frame = stack[-1]
+                for element in frame[1]:
+                    if isinstance(element, ssf_token_types):
+                        token_list.append(element)
+                    else:
+                        stack.append([element, iter(element.ssf_tokens_and_chunks), len(token_list)])
+                        break
+                else:
+                    stack.pop()
+                    if frame[0] is not None:
+                        token_spans[frame[0]] = (frame[2], len(token_list))
+            # the chunk lists and chunk token tuples are filled in when first asked for
+            self.ssf_cached_views = {"tokens": tuple(token_list), "token_spans": token_spans, "chunks": {}, "chunk_tokens": {}}
+        return self.ssf_cached_views
+
+    # function to return the tokens of this sentence as a tuple, kept until invalidate_cache is called
+    def cached_tokens(self):
+        return self.cached_views()["tokens"]
+
+    # function to return the chunks of this sentence in the given mode (see chunks) as a tuple, kept until invalidate_cache is called
+    def cached_chunks(self, mode="outer"):
+        chunk_lists = self.cached_views()["chunks"]
+        if mode not in chunk_lists:
+            chunk_lists[mode] = tuple(self.iter_chunks(mode))
+        return chunk_lists[mode]
+
+    # function to return the tokens of a chunk of this sentence as a tuple, kept until invalidate_cache is called
+    def cached_chunk_tokens(self, chunk):
+        cached_views = self.cached_views()
+        if chunk not in cached_views["chunk_tokens"]:
+            token_span = cached_views["token_spans"].get(chunk)
+            # a chunk which is not in the chunk tree of the sentence any more
+            if token_span is None:
+                return tuple(chunk.iter_tokens())
+            cached_views["chunk_tokens"][chunk] = cached_views["tokens"][token_span[0]:token_span[1]]
+        return cached_views["chunk_tokens"][chunk]
+
+    # function to return (start, end) of the tokens of a chunk of this sentence in cached_tokens, None if the chunk is not in the sentence
+    def token_span(self, chunk):
+        return self.cached_views()["token_spans"].get(chunk)
+
+    # function to drop the cached views, to be called after the chunks or tokens of the sentence are changed
+    def invalidate_cache(self):
+        self.ssf_cached_views = None
+
+    # only called for a missing attribute, i.e. for the chunks of a sentence read from a cache file which are not unpickled yet, see pack_ssf_documents
+    def __getattr__(self, name):
+        if (name == "ssf_chunks" or name == "ssf_chunk_names") and self.ssf_packed_chunks is not None:
+            ssf_packed_file, sentence_number = self.ssf_packed_chunks
+            if ssf_packed_file[2] is None:
+                unpack_ssf_documents(ssf_packed_file)
+            # still packed after the file is unpacked for a copy of a packed sentence, which shares the chunks of the sentence it was copied from
+            if self.ssf_packed_chunks is not None:
+                self.ssf_chunks, self.ssf_chunk_names = ssf_packed_file[2][sentence_number]
+                del self.ssf_packed_chunks
+            return object.__getattribute__(self, name)
+        raise AttributeError(name)
 
 
 # class representing a SSF document with ID information (in any case machine dynamic ID is provided in case of null IDs)
 class ssf_document(object):
     current_available_id = 0
+    # packed file of a document read from a cache file until the chunks of its sentences are first used, see pack_ssf_documents
+    ssf_packed_chunks = None
 
-    def __init__(self, parent_corpus, ssf_document_string, document_file_path, mode="lax"):
-        # set path and parent link
-        self.path = document_file_path
-        self.parent = parent_corpus
-        # list of ssf_sentence objects in the document
-        self.ssf_sentences = []
+    def __init__(self, parent_corpus, ssf_document_string, document_file_path, mode="lax", compact=False, keep_alternatives=False):
+        # set path, parent link and the (empty) list of ssf_sentence objects in the document
+        self.start_document(parent_corpus, document_file_path)
         # lax mode is where the sentences are not actually in document tags but are present
         if mode == "lax":
             # special document ID
@@ -320,10 +696,7 @@ class ssf_document(object):
             # send the sentence so that it can be validated and the object made; the regex is applied here to ensure that only one sentence reaches the ssf_sentence constructor
             # replaced [\w\W]+ with [\w\W]* in regex, if unexpected problems arise, switch back
             for ssf_sentence_string in re.findall("<Sentence[\w\W]*?</Sentence>", ssf_document_string):
-                ssf_sentence_object = ssf_sentence(self, ssf_sentence_string)
-                # if the sentence has chunks, it is valid
-                if len(ssf_sentence_object.ssf_chunks) > 0:
-                    self.ssf_sentences.append(ssf_sentence_object)
+                self.add_sentence(ssf_sentence_string, compact=compact, keep_alternatives=keep_alternatives)
         else:
             # this mode assumes that proper document tag encapsulation is present
             # replaced [\w\W]+ with [\w\W]* in regex, if unexpected problems arise, switch back
@@ -333,12 +706,38 @@ class ssf_document(object):
             # send the sentence so that it can be validated and the object made; the regex is applied here to ensure that only one sentence reaches the ssf_sentence constructor
             # replaced [\w\W]+ with [\w\W]* in regex, if unexpected problems arise, switch back
             for ssf_sentence_string in re.findall("<Sentence[\w\W]*?</Sentence>", ssf_document_content):
-                ssf_sentence_object = ssf_sentence(self, ssf_sentence_string)
-                # if the sentence has chunks, it is valid
                 # TODO: use exceptions instead of empty ssf_* objects
-                if len(ssf_sentence_object.ssf_chunks) > 0:
-                    self.ssf_sentences.append(ssf_sentence_object)
-                    # assign dynamic unique ID and update it
+                self.add_sentence(ssf_sentence_string, compact=compact, keep_alternatives=keep_alternatives)
+        self.finish_document()
+
+    # function to set up an empty document, used directly by the streaming reader which adds sentences one by one
+    def start_document(self, parent_corpus, document_file_path, ssf_id=None):
+        self.path = document_file_path
+        self.parent = parent_corpus
+        self.ssf_id = ssf_id
+        self.ssf_sentences = []
+
+    # function to build the ssf_sentence object for a sentence string
+    # returns the sentence if it is valid and None otherwise; with keep=False the sentence is not stored in the document (streaming)
+    # with compact=True the chunks and tokens are made in compact storage mode, with keep_alternatives=True the tokens keep every feature structure alternative
+    # if a rejections list is given, a (document path, document ID, sentence ID, reason, explanation) entry is added to it for an invalid sentence
+    def add_sentence(self, ssf_sentence_string, keep=True, compact=False, rejections=None, keep_alternatives=False):
+        ssf_sentence_object = ssf_sentence(self, ssf_sentence_string, compact, keep_alternatives)
+        # if the sentence has chunks, it is valid
+        if len(ssf_sentence_object.ssf_chunks) == 0:
+            ssf_event_counts[ssf_sentence_object.ssf_rejection[0]] += 1
+            logger.debug("Sentence rejected: %s", ssf_sentence_object.ssf_rejection[1])
+            if rejections is not None:
+                # a sentence without a proper tag has no ID
+                rejections.append((self.path, self.ssf_id, getattr(ssf_sentence_object, "ssf_id", None)) + ssf_sentence_object.ssf_rejection)
+            return None
+        if keep:
+            self.ssf_sentences.append(ssf_sentence_object)
+        return ssf_sentence_object
+
+    # function to close a document once all its sentences have been added
+    def finish_document(self):
+        # assign dynamic unique ID and update it
         self.id = ssf_document.current_available_id
         ssf_document.current_available_id += 1
 
@@ -348,40 +747,1317 @@ class ssf_document(object):
         return self.ssf_sentences
 
 
+# generator which scans SSF text line by line and reports the document and sentence spans in it, without reading the whole file in memory
+# with documents=True only sentences inside <document ...> ... </document> are reported (strict), otherwise every sentence is (lax)
+# yields ("document", header_text) when a document starts, ("sentence", sentence_string) for every sentence and ("end", None) when a document ends
+# the spans are the same ones the "<document[\w\W]*?</document>" and "<Sentence[\w\W]*?</Sentence>" regexes find
+# with offsets=True the lines are bytes (from a file opened in binary mode) and the spans are given by their byte offsets instead, i.e.
+# ("document", (start, header_bytes)), ("sentence", (start, end, header_bytes)) and ("end", end), the header being the rest of the opening line
+def scan_ssf_lines(lines, documents=True, offsets=False):
+    if offsets:
+        sentence_tag, sentence_end_tag, document_tag, document_end_tag = b"<Sentence", b"</Sentence>", b"<document", b"</document>"
+    else:
+        sentence_tag, sentence_end_tag, document_tag, document_end_tag = "<Sentence", "</Sentence>", "<document", "</document>"
+    in_document = False
+    # pieces of the sentence being read, None when outside a sentence
+    sentence_parts = None
+    # offset of the first line in the lines
+    line_offset = 0
+    for line in lines:
+        position = 0
+        while True:
+            if sentence_parts is not None:
+                sentence_end = line.find(sentence_end_tag, position)
+                if in_document:
+                    document_end = line.find(document_end_tag, position)
+                    # the document was closed before the sentence, so the unfinished sentence is not part of it
+                    if document_end != -1 and (sentence_end == -1 or document_end < sentence_end):
+                        sentence_parts = None
+                        in_document = False
+                        position = document_end + len(document_end_tag)
+                        yield "end", line_offset + position if offsets else None
+                        continue
+                if sentence_end == -1:
+                    if not offsets:
+                        sentence_parts.append(line[position:])
+                    break
+                sentence_end += len(sentence_end_tag)
+                if offsets:
+                    # the parts are (start, header) of the sentence
+                    yield "sentence", (sentence_parts[0], line_offset + sentence_end, sentence_parts[1])
+                else:
+                    sentence_parts.append(line[position:sentence_end])
+                    yield "sentence", "".join(sentence_parts)
+                sentence_parts = None
+                position = sentence_end
+            elif documents and not in_document:
+                document_start = line.find(document_tag, position)
+                if document_start == -1:
+                    break
+                in_document = True
+                position = document_start + len(document_tag)
+                yield "document", (line_offset + document_start, line[document_start:]) if offsets else line[document_start:]
+            else:
+                sentence_start = line.find(sentence_tag, position)
+                if in_document:
+                    document_end = line.find(document_end_tag, position)
+                    if document_end != -1 and (sentence_start == -1 or document_end < sentence_start):
+                        in_document = False
+                        position = document_end + len(document_end_tag)
+                        yield "end", line_offset + position if offsets else None
+                        continue
+                if sentence_start == -1:
+                    break
+                sentence_parts = [line_offset + sentence_start, line[sentence_start:]] if offsets else []
+                position = sentence_start
+        line_offset += len(line)
+
+
+# function to check if SSF text has at least one complete <document ...> ... </document> span, i.e. whether the lax fallback applies to it
+def has_ssf_documents(lines):
+    document_started = False
+    for line in lines:
+        if not document_started:
+            document_start = line.find("<document")
+            if document_start == -1:
+                continue
+            document_started = True
+            line = line[document_start:]
+        if "</document>" in line:
+            return True
+    return False
+
+
+# function to tell if a corpus file is processed in strict mode (documents only) or as one lax document
+# a file with document tags is always processed in strict mode, in lax mode the whole file is one document otherwise
+def ssf_file_is_strict(ssf_corpus_file_path, mode):
+    if mode != "lax":
+        return True
+    with open(ssf_corpus_file_path, "r") as ssf_corpus_file_handle:
+        return has_ssf_documents(ssf_corpus_file_handle)
+
+
+# function to find where a corpus file can be cut into parts for parallel loading
+# returns the (start, end) byte ranges of the parts
+# a file is only cut in front of a line starting a document, once the current part is at least part_size bytes long (never if part_size is None)
+def split_ssf_file(ssf_corpus_file_path, part_size):
+    byte_ranges = []
+    in_document = False
+    part_start = 0
+    position = 0
+    with open(ssf_corpus_file_path, "rb") as ssf_corpus_file_handle:
+        for line in ssf_corpus_file_handle:
+            if not in_document and part_size is not None and position - part_start >= part_size and b"<document" in line:
+                byte_ranges.append((part_start, position))
+                part_start = position
+            # follow the document tags in the line
+            tag_position = 0
+            while True:
+                if not in_document:
+                    tag_position = line.find(b"<document", tag_position)
+                    if tag_position == -1:
+                        break
+                    in_document = True
+                    tag_position += len(b"<document")
+                else:
+                    tag_position = line.find(b"</document>", tag_position)
+                    if tag_position == -1:
+                        break
+                    in_document = False
+                    tag_position += len(b"</document>")
+            position += len(line)
+    byte_ranges.append((part_start, position))
+    return byte_ranges
+
+
+# function to return the current values of the token, chunk, sentence and document ID counters
+def get_ssf_ids():
+    return ssf_token.current_available_id, ssf_chunk.current_available_id, ssf_sentence.current_available_id, ssf_document.current_available_id
+
+
+# function to set the token, chunk, sentence and document ID counters
+def set_ssf_ids(ssf_ids):
+    ssf_token.current_available_id, ssf_chunk.current_available_id, ssf_sentence.current_available_id, ssf_document.current_available_id = ssf_ids
+
+
+# function to parse one part of a corpus file with all the ID counters starting at 0, run by the worker processes of ssf_corpus.load_files
+# returns the valid documents (without parent link), the number of token, chunk, sentence and document IDs used for the part, its rejected sentences
+# and the (time taken, counts of the parse events) of the part, see ssf_corpus_stats
+def load_ssf_corpus_part(ssf_corpus_part):
+    ssf_corpus_folder, mode, compact, keep_alternatives, ssf_corpus_file_path, start, end, documents = ssf_corpus_part
+    start_time = time.perf_counter()
+    ssf_event_counts_before = ssf_event_counts.copy()
+    # the garbage collector is paused while the part is parsed, it is turned back on (if it was) to free the trees of earlier parts
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        set_ssf_ids((0, 0, 0, 0))
+        with open(ssf_corpus_file_path, "rb") as ssf_corpus_file_handle:
+            ssf_corpus_file_handle.seek(start)
+            ssf_part_bytes = ssf_corpus_file_handle.read(end - start)
+        # decoded like a file opened in text mode
+        ssf_part_lines = io.TextIOWrapper(io.BytesIO(ssf_part_bytes))
+        # only stands in as the parent of the documents while they are made, so it does not take a corpus ID
+        ssf_corpus_object = ssf_corpus.__new__(ssf_corpus)
+        ssf_corpus_object.path, ssf_corpus_object.mode, ssf_corpus_object.lazy, ssf_corpus_object.compact = ssf_corpus_folder, mode, True, compact
+        ssf_corpus_object.keep_alternatives = keep_alternatives
+        # the rejections are always collected, they are cached along with the documents
+        ssf_corpus_object.ssf_rejections = []
+        ssf_documents = []
+        for ssf_document_object, ssf_sentence_object in ssf_corpus_object.stream_lines(ssf_part_lines, ssf_corpus_file_path, documents):
+            if ssf_sentence_object is None:
+                ssf_document_object.parent = None
+                # equal strings are made the same object, which makes the pickled documents smaller and faster to load
+                intern_ssf_strings(ssf_document_object)
+                ssf_documents.append(ssf_document_object)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return ssf_documents, get_ssf_ids(), ssf_corpus_object.ssf_rejections, (time.perf_counter() - start_time, ssf_event_counts - ssf_event_counts_before)
+
+
+# function to add offsets to the IDs of a document and of all the sentences, chunks and tokens in it
+def shift_ssf_ids(ssf_document_object, token_offset, chunk_offset, sentence_offset, document_offset):
+    if token_offset == chunk_offset == sentence_offset == document_offset == 0:
+        return
+    ssf_document_object.id += document_offset
+    for ssf_sentence_object in ssf_document_object.sentences():
+        ssf_sentence_object.id += sentence_offset
+    # the chunks and tokens of a document read from a cache file are shifted once they are unpickled
+    if ssf_document_object.ssf_packed_chunks is not None:
+        token_id_offset, chunk_id_offset = ssf_document_object.ssf_packed_id_offsets
+        ssf_document_object.ssf_packed_id_offsets = token_id_offset + token_offset, chunk_id_offset + chunk_offset
+        return
+    shift_ssf_chunk_ids(ssf_document_object.sentences(), token_offset, chunk_offset)
+
+
+# function to add offsets to the chunk and token IDs of some sentences
+def shift_ssf_chunk_ids(ssf_sentence_objects, token_offset, chunk_offset):
+    if token_offset == chunk_offset == 0:
+        return
+    for ssf_sentence_object in ssf_sentence_objects:
+        for ssf_chunk_object in ssf_sentence_object.iter_chunks(mode="all"):
+            ssf_chunk_object.id += chunk_offset
+            for element in ssf_chunk_object.ssf_tokens_and_chunks:
+                if isinstance(element, ssf_token_types):
+                    element.id += token_offset
+
+
+# function to return copies of the documents of a corpus file for its cache file, in which the chunks of all their sentences are pickled together
+# the copies are new document and sentence objects sharing a packed file, the list [pickled chunks, [(document, its sentences)], None], the chunks themselves are not changed
+# a warm start only unpickles the documents and sentences, the chunks of the file are unpickled when any of its sentences first uses them (see unpack_ssf_documents)
+# this only defers the cost: once the chunks are used, a warm start of a 270k-token corpus takes 1.25 s against 4.0 s for parsing it (about 3x)
+def pack_ssf_documents(ssf_document_objects):
+    ssf_sentence_objects = [ssf_sentence_object for ssf_document_object in ssf_document_objects for ssf_sentence_object in ssf_document_object.sentences()]
+    # the chunks are pickled without the link to their sentence, unpack_ssf_documents puts it back
+    for ssf_sentence_object in ssf_sentence_objects:
+        for ssf_chunk_object in ssf_sentence_object.ssf_chunks:
+            ssf_chunk_object.parent = None
+    try:
+        ssf_packed_file = [pickle.dumps([(ssf_sentence_object.ssf_chunks, ssf_sentence_object.ssf_chunk_names) for ssf_sentence_object in ssf_sentence_objects], pickle.HIGHEST_PROTOCOL), [], None]
+    finally:
+        for ssf_sentence_object in ssf_sentence_objects:
+            for ssf_chunk_object in ssf_sentence_object.ssf_chunks:
+                ssf_chunk_object.parent = ssf_sentence_object
+    packed_documents = []
+    sentence_number = 0
+    for ssf_document_object in ssf_document_objects:
+        packed_document = ssf_document.__new__(ssf_document)
+        packed_document.__dict__.update(ssf_document_object.__dict__)
+        packed_document.ssf_sentences = []
+        for ssf_sentence_object in ssf_document_object.sentences():
+            packed_sentence = ssf_sentence.__new__(ssf_sentence)
+            packed_sentence.__dict__.update(ssf_sentence_object.__dict__)
+            del packed_sentence.ssf_chunks, packed_sentence.ssf_chunk_names
+            packed_sentence.parent = packed_document
+            packed_sentence.ssf_cached_views = None
+            packed_sentence.ssf_packed_chunks = (ssf_packed_file, sentence_number)
+            sentence_number += 1
+            packed_document.ssf_sentences.append(packed_sentence)
+        packed_document.ssf_packed_chunks = ssf_packed_file
+        # offsets still to be added to the chunk and token IDs, see shift_ssf_ids
+        packed_document.ssf_packed_id_offsets = (0, 0)
+        # the sentences are kept apart from ssf_sentences, which can be changed before the chunks are unpickled
+        ssf_packed_file[1].append((packed_document, tuple(packed_document.ssf_sentences)))
+        packed_documents.append(packed_document)
+    return packed_documents
+
+
+# function to unpickle the chunks of the sentences of a packed file, see pack_ssf_documents
+# the chunks are set on the packed sentences, with the pending ID offsets of their document added, and kept in the packed file for copies of the sentences
+def unpack_ssf_documents(ssf_packed_file):
+    ssf_packed_bytes, ssf_packed_documents, _ = ssf_packed_file
+    # the garbage collector is paused while the chunks are unpickled, like in ssf_corpus.load_files
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        ssf_sentence_chunks = pickle.loads(ssf_packed_bytes)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    ssf_packed_file[:] = [None, None, ssf_sentence_chunks]
+    sentence_number = 0
+    for ssf_document_object, ssf_sentence_objects in ssf_packed_documents:
+        for ssf_sentence_object in ssf_sentence_objects:
+            ssf_chunk_objects, ssf_chunk_names = ssf_sentence_chunks[sentence_number]
+            sentence_number += 1
+            for ssf_chunk_object in ssf_chunk_objects:
+                ssf_chunk_object.parent = ssf_sentence_object
+            ssf_sentence_object.ssf_chunks = ssf_chunk_objects
+            ssf_sentence_object.ssf_chunk_names = ssf_chunk_names
+            del ssf_sentence_object.ssf_packed_chunks
+        shift_ssf_chunk_ids(ssf_sentence_objects, *ssf_document_object.ssf_packed_id_offsets)
+        del ssf_document_object.ssf_packed_chunks, ssf_document_object.ssf_packed_id_offsets
+
+
+# function to replace the strings in a document by their interned copies
+def intern_ssf_strings(ssf_document_object):
+    for ssf_sentence_object in ssf_document_object.sentences():
+        for ssf_chunk_object in ssf_sentence_object.iter_chunks(mode="all"):
+            ssf_chunk_object.ssf_chunk_number = sys.intern(ssf_chunk_object.ssf_chunk_number)
+            ssf_chunk_object.ssf_chunk_type = sys.intern(ssf_chunk_object.ssf_chunk_type)
+            intern_ssf_feature_structure(ssf_chunk_object.ssf_feature_structure)
+            for element in ssf_chunk_object.ssf_tokens_and_chunks:
+                if isinstance(element, ssf_token_types):
+                    element.ssf_token_number = sys.intern(element.ssf_token_number)
+                    element.ssf_token_value = sys.intern(element.ssf_token_value)
+                    element.ssf_token_type = sys.intern(element.ssf_token_type)
+                    intern_ssf_feature_structure(element.ssf_feature_structure)
+                    if element.ssf_feature_structure_alternatives is not None:
+                        for alternative in element.ssf_feature_structure_alternatives:
+                            intern_ssf_feature_structure(alternative)
+
+
+# function to intern the string values of a feature structure, including the abbreviated features in "af"
+def intern_ssf_feature_structure(ssf_feature_structure):
+    for feature, value in ssf_feature_structure.items():
+        if isinstance(value, str):
+            ssf_feature_structure[feature] = sys.intern(value)
+        elif isinstance(value, dict):
+            for abbreviated_feature, abbreviated_value in value.items():
+                value[abbreviated_feature] = sys.intern(abbreviated_value)
+
+
+# version of the parsed object tree in the cache files, bump it whenever the parser output changes so that old caches are rebuilt
+ssf_cache_version = 8
+
+
+# function to return the key a cache file is valid for, i.e. the path, size and modification time of the corpus file, the mode, the storage mode, if the feature structure alternatives are kept and the parser version
+def ssf_cache_key(ssf_corpus_file_path, mode, compact=False, keep_alternatives=False):
+    ssf_corpus_file_stat = os.stat(ssf_corpus_file_path)
+    return os.path.abspath(ssf_corpus_file_path), ssf_corpus_file_stat.st_size, ssf_corpus_file_stat.st_mtime_ns, mode, compact, keep_alternatives, __version__, ssf_cache_version
+
+
+# function to return the (size, modification time, SHA-1 of the content) of a corpus file, which tells if it changed, see ssf_corpus.refresh
+# with content=False the file is not read and the SHA-1 is None
+def ssf_file_signature(ssf_corpus_file_path, content=True):
+    ssf_corpus_file_stat = os.stat(ssf_corpus_file_path)
+    if not content:
+        return ssf_corpus_file_stat.st_size, ssf_corpus_file_stat.st_mtime_ns, None
+    ssf_file_hash = hashlib.sha1()
+    with open(ssf_corpus_file_path, "rb") as ssf_corpus_file_handle:
+        for ssf_block in iter(lambda: ssf_corpus_file_handle.read(1024 * 1024), b""):
+            ssf_file_hash.update(ssf_block)
+    return ssf_corpus_file_stat.st_size, ssf_corpus_file_stat.st_mtime_ns, ssf_file_hash.hexdigest()
+
+
+# function to return the path of the cache file of a corpus file in the cache folder
+# the extension tells apart the different kinds of cache files of the same corpus file, e.g. the offset index (see build_ssf_offset_index)
+def ssf_cache_file_path(ssf_cache_folder, ssf_cache_key, extension=".pickle"):
+    ssf_cache_name = hashlib.sha1(("%s\n%s\n%s\n%s" % (ssf_cache_key[0], ssf_cache_key[3], ssf_cache_key[4], ssf_cache_key[5])).encode("utf-8")).hexdigest()
+    return os.path.join(ssf_cache_folder, ssf_cache_name + extension)
+
+
+# function to read the (documents, used IDs, first IDs, rejected sentences, parse statistics) of a corpus file from its cache file
+# the documents are the ones returned by load_ssf_corpus_part for the whole file, packed by pack_ssf_documents, with their IDs counted from the first IDs
+# returns None if there is no cache file or if it was made for another version of the corpus file
+def read_ssf_cache(ssf_cache_folder, ssf_cache_key, extension=".pickle"):
+    try:
+        with open(ssf_cache_file_path(ssf_cache_folder, ssf_cache_key, extension), "rb") as ssf_cache_file_handle:
+            # the key is stored first, so that an outdated cache is detected without loading the documents
+            if pickle.load(ssf_cache_file_handle) != ssf_cache_key:
+                return None
+            return pickle.load(ssf_cache_file_handle)
+    except (IOError, OSError):
+        return None
+    except Exception:
+        logger.warning("Bad cache file for %s, it will be rebuilt." % ssf_cache_key[0])
+        return None
+
+
+# function to write the (documents, used IDs, first IDs, rejected sentences, parse statistics) of a corpus file to its cache file
+def write_ssf_cache(ssf_cache_folder, ssf_cache_key, ssf_file_result, extension=".pickle"):
+    if not os.path.isdir(ssf_cache_folder):
+        os.makedirs(ssf_cache_folder)
+    ssf_cache_path = ssf_cache_file_path(ssf_cache_folder, ssf_cache_key, extension)
+    # written next to the cache file and renamed, so that an interrupted write never leaves a broken cache file
+    ssf_temporary_path = "%s.%d.tmp" % (ssf_cache_path, os.getpid())
+    with open(ssf_temporary_path, "wb") as ssf_cache_file_handle:
+        pickle.dump(ssf_cache_key, ssf_cache_file_handle, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(ssf_file_result, ssf_cache_file_handle, pickle.HIGHEST_PROTOCOL)
+    os.replace(ssf_temporary_path, ssf_cache_path)
+
+
+# function to find the byte offsets of the documents and sentences of a corpus file, read the same way as by ssf_corpus in the given mode
+# returns (document IDs, document offsets, sentence IDs, sentence offsets, sentence documents), where the offsets are arrays of flattened
+# (start, end) byte offset pairs of the <document ...> ... </document> and <Sentence ...> ... </Sentence> spans and sentence documents
+# is the array of the number of the document of every sentence
+# in lax mode a file without document tags is one "null_lax" document spanning the whole file, in strict mode a document left open is dropped
+# a sentence without a <Sentence id=...> header on its first line gets the ID None, as it cannot be looked up
+def build_ssf_offset_index(ssf_corpus_file_path, mode="lax"):
+    documents = ssf_file_is_strict(ssf_corpus_file_path, mode)
+    document_ids, document_offsets = [], array.array("q")
+    sentence_ids, sentence_offsets, sentence_documents = [], array.array("q"), array.array("q")
+    # (ID, start, end) of the sentences of the document being read, they are only added once the document is closed
+    document_sentences = []
+    with open(ssf_corpus_file_path, "rb") as ssf_corpus_file_handle:
+        for span_type, span in scan_ssf_lines(ssf_corpus_file_handle, documents, offsets=True):
+            if span_type == "sentence":
+                ssf_sentence_match = re.search(b"<Sentence id=(?:\"|')(.*?)(?:\"|')>", span[2])
+                ssf_sentence_id = decode_ssf_bytes(ssf_sentence_match.group(1)) if ssf_sentence_match is not None else None
+                document_sentences.append((ssf_sentence_id, span[0], span[1]))
+            elif span_type == "document":
+                # same validation as in ssf_document, the document ID can be null
+                ssf_document_id = decode_ssf_bytes(re.findall(b"<document (?:doc)?id=(?:\"|')(.*?)(?:\"|')>", span[1])[0])
+                document_start = span[0]
+                document_sentences = []
+            else:
+                for ssf_sentence_id, start, end in document_sentences:
+                    sentence_ids.append(ssf_sentence_id)
+                    sentence_offsets.extend((start, end))
+                    sentence_documents.append(len(document_ids))
+                document_ids.append(ssf_document_id)
+                document_offsets.extend((document_start, span))
+    if not documents:
+        for ssf_sentence_id, start, end in document_sentences:
+            sentence_ids.append(ssf_sentence_id)
+            sentence_offsets.extend((start, end))
+            sentence_documents.append(0)
+        document_ids.append("null_lax")
+        document_offsets.extend((0, os.path.getsize(ssf_corpus_file_path)))
+    return document_ids, document_offsets, sentence_ids, sentence_offsets, sentence_documents
+
+
+# function to decode bytes of a corpus file like a file opened in text mode
+def decode_ssf_bytes(ssf_bytes):
+    return io.TextIOWrapper(io.BytesIO(ssf_bytes)).read()
+
+
+# class collecting the parse statistics of a corpus, see ssf_corpus
+# files holds a record (dict) for every corpus file read, with its path, the time taken in seconds, if it was read from the cache, the number of
+# valid documents and sentences, the number of rejected sentences and the counts of the parse events by name (see ssf_event_counts)
+# file_callback, if given, is called with every record as soon as the file is read
+# for a file read by a lazy corpus, the time is the time spent reading it without the time spent by the caller between its sentences
+class ssf_corpus_stats(object):
+
+    def __init__(self, file_callback=None):
+        self.file_callback = file_callback
+        self.files = []
+        # totals over all the files
+        self.seconds = 0.0
+        self.documents = 0
+        self.sentences_accepted = 0
+        self.sentences_rejected = 0
+        self.events = collections.Counter()
+
+    # function to add the record of a file read, events are the counts of its parse events
+    def add_file(self, ssf_corpus_file_path, seconds, documents, sentences_accepted, events, cached=False):
+        sentences_rejected = sum(events[reason] for reason in ssf_rejection_reasons)
+        ssf_file_record = {"path": ssf_corpus_file_path, "seconds": seconds, "cached": cached, "documents": documents, "sentences_accepted": sentences_accepted, "sentences_rejected": sentences_rejected, "events": dict(events)}
+        self.files.append(ssf_file_record)
+        self.seconds += seconds
+        self.documents += documents
+        self.sentences_accepted += sentences_accepted
+        self.sentences_rejected += sentences_rejected
+        self.events.update(events)
+        if self.file_callback is not None:
+            self.file_callback(ssf_file_record)
+
+    # function to drop the records of some files, e.g. the ones removed or read again by ssf_corpus.refresh, the totals are made again from the other records
+    def remove_files(self, ssf_corpus_file_paths):
+        ssf_corpus_file_paths = set(ssf_corpus_file_paths)
+        self.files = [ssf_file_record for ssf_file_record in self.files if ssf_file_record["path"] not in ssf_corpus_file_paths]
+        self.seconds = sum(ssf_file_record["seconds"] for ssf_file_record in self.files)
+        self.documents = sum(ssf_file_record["documents"] for ssf_file_record in self.files)
+        self.sentences_accepted = sum(ssf_file_record["sentences_accepted"] for ssf_file_record in self.files)
+        self.sentences_rejected = sum(ssf_file_record["sentences_rejected"] for ssf_file_record in self.files)
+        self.events = collections.Counter()
+        for ssf_file_record in self.files:
+            self.events.update(ssf_file_record["events"])
+
+    # generator passing on what ssf_corpus.stream_file yields for a file, which adds the record of the file once it is read to the end
+    def measure_stream(self, ssf_stream, ssf_corpus_file_path):
+        seconds = 0.0
+        documents = sentences = 0
+        # the documents are counted as they are seen, as with keep_sentences=False the complete documents are not yielded
+        last_ssf_document_object = None
+        ssf_event_counts_before = ssf_event_counts.copy()
+        start = time.perf_counter()
+        for ssf_document_object, ssf_sentence_object in ssf_stream:
+            seconds += time.perf_counter() - start
+            if ssf_document_object is not last_ssf_document_object:
+                documents += 1
+                last_ssf_document_object = ssf_document_object
+            if ssf_sentence_object is not None:
+                sentences += 1
+            yield ssf_document_object, ssf_sentence_object
+            start = time.perf_counter()
+        seconds += time.perf_counter() - start
+        self.add_file(ssf_corpus_file_path, seconds, documents, sentences, ssf_event_counts - ssf_event_counts_before)
+
+    # function to return the number of rejected sentences by reason
+    def rejections(self):
+        return dict((reason, self.events[reason]) for reason in ssf_rejection_reasons if self.events[reason] > 0)
+
+    # function to return the totals as a dict, e.g. to be written as JSON
+    def summary(self):
+        return {"files": len(self.files), "seconds": self.seconds, "documents": self.documents, "sentences_accepted": self.sentences_accepted, "sentences_rejected": self.sentences_rejected, "rejections": self.rejections(), "events": dict(self.events)}
+
+
 # class representing a SSF corpus with ID information (in any case machine dynamic ID is provided in case of null IDs)
+# with lazy=True nothing is loaded up front and the corpus is read file by file through iter_documents() and iter_sentences()
+# with workers=N (N > 1) the files are loaded by N processes and with cache_folder the parsed files are cached there, see load_files
+# with compact=True the chunks and tokens are made in compact storage mode (see compact_ssf_token), which takes much less memory
+# with keep_alternatives=True the tokens keep the feature structure of every "|" alternative besides the merged one, see ssf_token
+# with diagnostics=True the reason why each invalid sentence was left out is kept in ssf_rejections
+# with stats=True (or a ssf_corpus_stats object, e.g. one with a file_callback) the parse statistics of every file read are kept in ssf_stats
+# with track_changes=True the content of every file read is hashed, so that refresh does not read again a file which was only touched
 class ssf_corpus(object):
     current_available_id = 0
+    # files bigger than this many bytes are cut into parts of whole documents for parallel loading
+    parallel_part_size = 4 * 1024 * 1024
 
-    def __init__(self, ssf_corpus_folder, mode="lax"):
+    def __init__(self, ssf_corpus_folder, mode="lax", lazy=False, workers=None, cache_folder=None, compact=False, diagnostics=False, stats=False, keep_alternatives=False, track_changes=False):
         # set path and parent link
         self.path = os.path.abspath(ssf_corpus_folder)
+        self.mode = mode
+        self.lazy = lazy
+        self.compact = compact
+        self.keep_alternatives = keep_alternatives
+        # with diagnostics=True, the (document path, document ID, sentence ID, reason, explanation) of every invalid sentence, see ssf_sentence.ssf_rejection
+        self.ssf_rejections = [] if diagnostics else None
+        # ssf_corpus_stats object, None when the statistics are not collected
+        if isinstance(stats, ssf_corpus_stats):
+            self.ssf_stats = stats
+        else:
+            self.ssf_stats = ssf_corpus_stats() if stats else None
+        self.workers = workers
+        self.cache_folder = cache_folder
+        self.track_changes = track_changes
         # list of ssf_document objects in this corpus
         self.ssf_documents = []
-        for ssf_corpus_file in os.listdir(ssf_corpus_folder):
-            ssf_corpus_file_handle = open(ssf_corpus_folder + ssf_corpus_file, "r")
-            # send the document so that it can be validated and the object made; the regex is applied here to ensure that only one document reaches the ssf_document constructor
-            ssf_corpus_text = ssf_corpus_file_handle.read()
-            # replaced [\w\W]+ with [\w\W]* in regex, if unexpected problems arise, switch back
-            ssf_document_string_list = re.findall("<document[\w\W]*?</document>", ssf_corpus_text)
-            for ssf_document_string in ssf_document_string_list:
-                ssf_document_object = ssf_document(self, ssf_document_string, os.path.abspath(ssf_corpus_folder + ssf_corpus_file), mode="strict")
-                # if the document has sentences, it is valid
-                if len(ssf_document_object.ssf_sentences) > 0:
-                    self.ssf_documents.append(ssf_document_object)
-            if mode == "lax":
-                # assume each document is a bunch of sentences not encapsulated in document tags
-                ssf_document_string = ssf_corpus_text
-                if len(ssf_document_string_list) == 0:
-                    ssf_document_object = ssf_document(self, ssf_document_string, os.path.abspath(ssf_corpus_folder + ssf_corpus_file))
-                    # if the document has sentences, it is valid
-                    if len(ssf_document_object.ssf_sentences) > 0:
-                        self.ssf_documents.append(ssf_document_object)
-            ssf_corpus_file_handle.close()
-            # assign dynamic unique ID and update it
+        # file path -> signature of every file read (see ssf_file_signature), taken before the file is read, see refresh
+        self.ssf_file_signatures = {}
+        if not lazy:
+            ssf_corpus_file_paths = self.file_paths()
+            for ssf_corpus_file_path in ssf_corpus_file_paths:
+                self.ssf_file_signatures[ssf_corpus_file_path] = ssf_file_signature(ssf_corpus_file_path, self.track_changes)
+            self.ssf_documents = self.read_files(ssf_corpus_file_paths)
+        # assign dynamic unique ID and update it
         self.id = ssf_corpus.current_available_id
         ssf_corpus.current_available_id += 1
 
+    # function to return the absolute paths of all files in the corpus folder
+    def file_paths(self):
+        return [os.path.join(self.path, ssf_corpus_file) for ssf_corpus_file in os.listdir(self.path)]
+
+    # function to return the valid ssf_document objects of some corpus files, read the way the corpus is set up to (see load_files)
+    def read_files(self, ssf_corpus_file_paths):
+        if (self.workers is not None and self.workers > 1) or self.cache_folder is not None:
+            return self.load_files(ssf_corpus_file_paths, self.workers, self.cache_folder)
+        ssf_documents = []
+        for ssf_corpus_file_path in ssf_corpus_file_paths:
+            ssf_documents += self.file_documents(ssf_corpus_file_path)
+        return ssf_documents
+
+    # function to bring the corpus up to date with its folder, only the files added, removed or modified since they were read are parsed (again)
+    # a file is modified when its size or modification time changed and, with track_changes=True, also its content, so a file which is only touched is not parsed again
+    # the documents of a modified file replace its old documents in place in ssf_documents and the documents of an added file come at the end
+    # the other documents are left as they are, with the same IDs, and the new documents take new IDs
+    # returns the (added, removed, modified) file paths, there is nothing to refresh in a lazy corpus as it always reads the files as they are
+    def refresh(self):
+        if self.lazy:
+            return [], [], []
+        ssf_corpus_file_paths = self.file_paths()
+        ssf_file_signatures = {}
+        added, modified = [], []
+        for ssf_corpus_file_path in ssf_corpus_file_paths:
+            old_signature = self.ssf_file_signatures.get(ssf_corpus_file_path)
+            ssf_corpus_file_stat = os.stat(ssf_corpus_file_path)
+            # the content is only hashed again when the size or modification time changed
+            if old_signature is not None and old_signature[:2] == (ssf_corpus_file_stat.st_size, ssf_corpus_file_stat.st_mtime_ns):
+                ssf_file_signatures[ssf_corpus_file_path] = old_signature
+                continue
+            ssf_file_signatures[ssf_corpus_file_path] = ssf_file_signature(ssf_corpus_file_path, self.track_changes)
+            if old_signature is None:
+                added.append(ssf_corpus_file_path)
+            # without the content hashes (track_changes=False), a file whose size or modification time changed is taken as modified
+            elif old_signature[2] is None or old_signature[2] != ssf_file_signatures[ssf_corpus_file_path][2]:
+                modified.append(ssf_corpus_file_path)
+        removed = [ssf_corpus_file_path for ssf_corpus_file_path in self.ssf_file_signatures if ssf_corpus_file_path not in ssf_file_signatures]
+        self.ssf_file_signatures = ssf_file_signatures
+        if len(added) + len(removed) + len(modified) == 0:
+            return added, removed, modified
+        changed = set(removed + modified)
+        if self.ssf_rejections is not None:
+            self.ssf_rejections[:] = [ssf_rejection for ssf_rejection in self.ssf_rejections if ssf_rejection[0] not in changed]
+        # the modified files get new records when they are read again
+        if self.ssf_stats is not None:
+            self.ssf_stats.remove_files(changed)
+        new_documents = {}
+        for ssf_document_object in self.read_files(modified + added):
+            new_documents.setdefault(ssf_document_object.path, []).append(ssf_document_object)
+        ssf_documents = []
+        for ssf_document_object in self.ssf_documents:
+            if ssf_document_object.path not in changed:
+                ssf_documents.append(ssf_document_object)
+            # the new documents of a modified file take the place of the first of its old documents
+            elif ssf_document_object.path in new_documents:
+                ssf_documents += new_documents.pop(ssf_document_object.path)
+        # the added files, and the modified files which had no valid document before
+        for ssf_corpus_file_path in modified + added:
+            ssf_documents += new_documents.pop(ssf_corpus_file_path, [])
+        self.ssf_documents[:] = ssf_documents
+        return added, removed, modified
+
+    # generator over the valid ssf_document objects of one corpus file
+    def file_documents(self, ssf_corpus_file_path):
+        for ssf_document_object, ssf_sentence_object in self.stream_file(ssf_corpus_file_path):
+            if ssf_sentence_object is None:
+                yield ssf_document_object
+
+    # generator which reads one corpus file incrementally
+    # yields (document, sentence) for every valid sentence, and (document, None) for every valid document once it is complete
+    # a sentence is yielded as soon as its </Sentence> is read in a lax document, and once its </document> is read in strict mode (see stream_lines)
+    # with keep_sentences=False the sentences are not stored in their documents, so that memory is bounded by one sentence (one document text in strict mode)
+    def stream_file(self, ssf_corpus_file_path, keep_sentences=True):
+        if self.ssf_stats is not None:
+            return self.ssf_stats.measure_stream(self.read_file(ssf_corpus_file_path, keep_sentences), ssf_corpus_file_path)
+        return self.read_file(ssf_corpus_file_path, keep_sentences)
+
+    # generator doing the work of stream_file
+    def read_file(self, ssf_corpus_file_path, keep_sentences=True):
+        documents = ssf_file_is_strict(ssf_corpus_file_path, self.mode)
+        with open(ssf_corpus_file_path, "r") as ssf_corpus_file_handle:
+            for ssf_document_object, ssf_sentence_object in self.stream_lines(ssf_corpus_file_handle, ssf_corpus_file_path, documents, keep_sentences):
+                yield ssf_document_object, ssf_sentence_object
+
+    # generator doing the work of stream_file for some lines of a corpus file
+    # documents tells if the lines are read in strict mode (documents only) or as one lax document
+    # in strict mode the sentence strings of a document are kept until its </document> is read and only then parsed, so memory is bounded by the text of one document
+    # a document left open at the end of the lines is incomplete and dropped without parsing its sentences, just like the regex would not match it
+    def stream_lines(self, ssf_corpus_lines, ssf_corpus_file_path, documents, keep_sentences=True):
+        ssf_document_object = None
+        if not documents:
+            ssf_document_object = ssf_document.__new__(ssf_document)
+            ssf_document_object.start_document(self, ssf_corpus_file_path, "null_lax")
+        # opening tag and sentence strings of the open document in strict mode
+        ssf_document_header = None
+        ssf_sentence_strings = []
+        for span_type, span_text in scan_ssf_lines(ssf_corpus_lines, documents):
+            if span_type == "sentence":
+                if documents:
+                    ssf_sentence_strings.append(span_text)
+                    continue
+                ssf_sentence_object = ssf_document_object.add_sentence(span_text, keep_sentences, self.compact, self.ssf_rejections, self.keep_alternatives)
+                if ssf_sentence_object is not None:
+                    yield ssf_document_object, ssf_sentence_object
+            elif span_type == "document":
+                ssf_document_header = span_text
+                ssf_sentence_strings = []
+            else:
+                # same validation as in ssf_document, the document ID can be null
+                ssf_document_id = re.findall("<document (?:doc)?id=(?:\"|')(.*?)(?:\"|')>", ssf_document_header)[0]
+                ssf_document_object = ssf_document.__new__(ssf_document)
+                ssf_document_object.start_document(self, ssf_corpus_file_path, ssf_document_id)
+                for ssf_sentence_string in ssf_sentence_strings:
+                    ssf_sentence_object = ssf_document_object.add_sentence(ssf_sentence_string, keep_sentences, self.compact, self.ssf_rejections, self.keep_alternatives)
+                    if ssf_sentence_object is not None:
+                        yield ssf_document_object, ssf_sentence_object
+                ssf_sentence_strings = []
+                ssf_document_object.finish_document()
+                # if the document has sentences, it is valid
+                if len(ssf_document_object.ssf_sentences) > 0:
+                    yield ssf_document_object, None
+                ssf_document_object = None
+        if not documents:
+            ssf_document_object.finish_document()
+            if len(ssf_document_object.ssf_sentences) > 0:
+                yield ssf_document_object, None
+
+    # function to load corpus files through parts parsed with all the ID counters starting at 0 (see load_ssf_corpus_part)
+    # with workers > 1 the parts are parsed by a pool of worker processes, a big file is cut into several parts made of whole documents
+    # with cache_folder a file whose cache is up to date is read from its cache instead of being parsed, the cache of every parsed file is (re)written
+    # only the documents and sentences are unpickled up front, the chunks of a cached file are unpickled when first used (see pack_ssf_documents)
+    # the results are taken in file order and their IDs shifted by the IDs used before them, so the IDs are the same as in a serial run
+    def load_files(self, ssf_corpus_file_paths, workers=None, cache_folder=None):
+        parallel = workers is not None and workers > 1
+        # (documents, used IDs, first IDs, rejected sentences, (parse time, parse event counts)) of every file, the IDs in the documents are counted from the first IDs
+        ssf_file_results = [None] * len(ssf_corpus_file_paths)
+        ssf_cache_keys = {}
+        # time taken to read the files found in the cache
+        ssf_cache_seconds = {}
+        ssf_corpus_parts = []
+        ssf_part_file_numbers = []
+        # the garbage collector is paused while the results are unpickled, as it would otherwise scan the growing object tree over and over
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for file_number, ssf_corpus_file_path in enumerate(ssf_corpus_file_paths):
+                if cache_folder is not None:
+                    start_time = time.perf_counter()
+                    ssf_cache_keys[file_number] = ssf_cache_key(ssf_corpus_file_path, self.mode, self.compact, self.keep_alternatives)
+                    ssf_file_results[file_number] = read_ssf_cache(cache_folder, ssf_cache_keys[file_number])
+                    if ssf_file_results[file_number] is not None:
+                        ssf_cache_seconds[file_number] = time.perf_counter() - start_time
+                        continue
+                documents = ssf_file_is_strict(ssf_corpus_file_path, self.mode)
+                byte_ranges = split_ssf_file(ssf_corpus_file_path, ssf_corpus.parallel_part_size if parallel else None)
+                for start, end in byte_ranges:
+                    ssf_corpus_parts.append((self.path, self.mode, self.compact, self.keep_alternatives, ssf_corpus_file_path, start, end, documents))
+                    ssf_part_file_numbers.append(file_number)
+            if parallel:
+                ssf_pool = multiprocessing.Pool(workers)
+                # imap returns the results in the order of the parts
+                ssf_part_results = ssf_pool.imap(load_ssf_corpus_part, ssf_corpus_parts)
+            else:
+                ssf_pool = None
+                ssf_part_results = (load_ssf_corpus_part(ssf_corpus_part) for ssf_corpus_part in ssf_corpus_parts)
+            ssf_ids = get_ssf_ids()
+            try:
+                # join the parts of every file
+                for file_number, (ssf_part_documents, used_ids, rejections, (seconds, events)) in zip(ssf_part_file_numbers, ssf_part_results):
+                    if ssf_file_results[file_number] is None:
+                        ssf_file_results[file_number] = (ssf_part_documents, used_ids, (0, 0, 0, 0), rejections, (seconds, events))
+                        continue
+                    ssf_file_documents, ssf_file_used_ids, first_ids, ssf_file_rejections, (ssf_file_seconds, ssf_file_events) = ssf_file_results[file_number]
+                    for ssf_document_object in ssf_part_documents:
+                        shift_ssf_ids(ssf_document_object, *ssf_file_used_ids)
+                    ssf_file_results[file_number] = (ssf_file_documents + ssf_part_documents, tuple(a + b for a, b in zip(ssf_file_used_ids, used_ids)), first_ids, ssf_file_rejections + rejections, (ssf_file_seconds + seconds, ssf_file_events + events))
+            finally:
+                # the parts parsed in this process have changed the ID counters
+                set_ssf_ids(ssf_ids)
+                if ssf_pool is not None:
+                    ssf_pool.close()
+                    ssf_pool.join()
+            parsed_file_numbers = set(ssf_part_file_numbers)
+            ssf_documents = []
+            for file_number, (ssf_file_documents, used_ids, first_ids, rejections, (seconds, events)) in enumerate(ssf_file_results):
+                ssf_ids = get_ssf_ids()
+                # nothing to do when the IDs are the same as when the file was cached, e.g. if no file before it changed
+                for ssf_document_object in ssf_file_documents:
+                    shift_ssf_ids(ssf_document_object, *[a - b for a, b in zip(ssf_ids, first_ids)])
+                if cache_folder is not None and file_number in parsed_file_numbers:
+                    # the chunks are pickled on their own, so that they are only unpickled when used, see pack_ssf_documents
+                    write_ssf_cache(cache_folder, ssf_cache_keys[file_number], (pack_ssf_documents(ssf_file_documents), used_ids, ssf_ids, rejections, (seconds, events)))
+                if self.ssf_stats is not None:
+                    # the parse event counts of a cached file are the ones from when it was parsed
+                    self.ssf_stats.add_file(ssf_corpus_file_paths[file_number], ssf_cache_seconds.get(file_number, seconds), len(ssf_file_documents), sum(len(ssf_document_object.ssf_sentences) for ssf_document_object in ssf_file_documents), events, file_number in ssf_cache_seconds)
+                for ssf_document_object in ssf_file_documents:
+                    ssf_document_object.parent = self
+                set_ssf_ids(tuple(a + b for a, b in zip(ssf_ids, used_ids)))
+                ssf_documents += ssf_file_documents
+                if self.ssf_rejections is not None:
+                    self.ssf_rejections += rejections
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return ssf_documents
+
+    # generator over the valid documents of the corpus, read one file at a time for a lazy corpus
+    # memory is bounded by one document
+    def iter_documents(self):
+        if not self.lazy:
+            for ssf_document_object in self.ssf_documents:
+                yield ssf_document_object
+            return
+        for ssf_corpus_file_path in self.file_paths():
+            for ssf_document_object in self.file_documents(ssf_corpus_file_path):
+                yield ssf_document_object
+
+    # generator over the valid sentences of the corpus, each one is yielded as soon as it is read for a lazy corpus (see stream_file)
+    # sentences are not kept in their (parent) documents, so memory is bounded by one sentence (and the text of one document in strict mode)
+    def iter_sentences(self):
+        if not self.lazy:
+            for ssf_document_object in self.ssf_documents:
+                for ssf_sentence_object in ssf_document_object.sentences():
+                    yield ssf_sentence_object
+            return
+        for ssf_corpus_file_path in self.file_paths():
+            for ssf_document_object, ssf_sentence_object in self.stream_file(ssf_corpus_file_path, keep_sentences=False):
+                if ssf_sentence_object is not None:
+                    yield ssf_sentence_object
+
     # function to return all document in this corpus
     def documents(self):
         #return all documents in the corpus
         return self.ssf_documents
+
+    # function to write the corpus to one SSF file, see ssf_writer
+    # a lazy corpus is read and written one sentence at a time, so memory is bounded by one sentence
+    def write_file(self, ssf_file_path, buffer_size=1024 * 1024):
+        with open(ssf_file_path, "w") as ssf_file_handle:
+            ssf_writer_object = ssf_writer(ssf_file_handle, buffer_size)
+            if self.lazy:
+                for ssf_corpus_file_path in self.file_paths():
+                    ssf_writer_object.write_stream(self.stream_file(ssf_corpus_file_path, keep_sentences=False))
+            else:
+                for ssf_document_object in self.ssf_documents:
+                    ssf_writer_object.write_document(ssf_document_object)
+            ssf_writer_object.flush()
+
+    # function to flatten the corpus into a ssf_token_table, in one pass over iter_documents()
+    def to_columns(self):
+        return build_ssf_token_table(self.iter_documents())
+
+
+# function to return the "<fs ...>" string of a feature structure, "" for an empty one
+# "af" comes first with its 8 values in the canonical order (see ssf_abbreviated_feature_names) and a resolved "drel" is written back as label:name
+# values are quoted with ' unless they contain one
+def ssf_feature_structure_string(ssf_feature_structure):
+    if len(ssf_feature_structure) == 0:
+        return ""
+    features = []
+    if "af" in ssf_feature_structure:
+        features.append(ssf_feature_string("af", ssf_feature_structure["af"]))
+    for feature, value in ssf_feature_structure.items():
+        if feature != "af":
+            features.append(ssf_feature_string(feature, value))
+    return "<fs " + " ".join(features) + ">"
+
+
+# function to return the feature=value string of one feature, see ssf_feature_structure_string
+def ssf_feature_string(feature, value):
+    if isinstance(value, str):
+        pass
+    elif isinstance(value, tuple):
+        # (label, chunk) of a resolved inter chunk reference, see ssf_sentence.resolve_inter_chunk_references
+        value = value[0] + ":" + value[1].ssf_feature_structure["name"]
+    elif isinstance(value, ssf_abbreviated_features):
+        value = ",".join(value.ssf_values)
+    else:
+        value = ",".join([value[name] for name in ssf_abbreviated_feature_names])
+    if "'" in value:
+        return feature + "=\"" + value + "\""
+    return feature + "='" + value + "'"
+
+
+# function to return the lines of a sentence in SSF, the chunks are written inside an SSF chunk (chunk 0)
+# the chunk tree is walked with an explicit stack of element iterators, like ssf_chunk.iter_tokens
+def ssf_sentence_lines(ssf_sentence_object):
+    ssf_lines = ["<Sentence id='%s'>" % ssf_sentence_object.ssf_id, "0\t((\tSSF"]
+    stack = [iter(ssf_sentence_object.ssf_chunks)]
+    while len(stack) > 0:
+        for element in stack[-1]:
+            if isinstance(element, ssf_token_types):
+                ssf_token_fields = [element.ssf_token_number, element.ssf_token_value, element.ssf_token_type]
+                # kept feature structure alternatives are written back as such, see ssf_token
+                if element.ssf_feature_structure_alternatives is not None and len(element.ssf_feature_structure_alternatives) > 1:
+                    feature_structure_string = "|".join([ssf_feature_structure_string(alternative) for alternative in element.ssf_feature_structure_alternatives])
+                else:
+                    feature_structure_string = ssf_feature_structure_string(element.ssf_feature_structure)
+                if feature_structure_string != "":
+                    ssf_token_fields.append(feature_structure_string)
+                ssf_lines.append("\t".join(ssf_token_fields))
+            else:
+                ssf_chunk_fields = [element.ssf_chunk_number, "((", element.ssf_chunk_type]
+                feature_structure_string = ssf_feature_structure_string(element.ssf_feature_structure)
+                if feature_structure_string != "":
+                    ssf_chunk_fields.append(feature_structure_string)
+                ssf_lines.append("\t".join(ssf_chunk_fields))
+                # continue with the nested chunk, then come back to this one
+                stack.append(iter(element.ssf_tokens_and_chunks))
+                break
+        else:
+            stack.pop()
+            # the chunk is closed, the SSF chunk is closed after the loop
+            if len(stack) > 0:
+                ssf_lines.append("\t))")
+    ssf_lines.append("\t))")
+    ssf_lines.append("</Sentence>")
+    return ssf_lines
+
+
+# class writing documents and sentences to a file handle opened in text mode, in SSF that ssf_corpus reads back into the same trees
+# the text is buffered and written in pieces of about buffer_size characters, call flush() once done (it does not close the file handle)
+# documents are always written with <document id=...> tags, so the lax "null_lax" documents are read back in strict mode
+class ssf_writer(object):
+
+    def __init__(self, ssf_file_handle, buffer_size=1024 * 1024):
+        self.file_handle = ssf_file_handle
+        self.buffer_size = buffer_size
+        self.ssf_buffer = []
+        self.ssf_buffer_length = 0
+        # the document whose <document> tag is written but not closed yet
+        self.ssf_document = None
+
+    # function to write a document with all its sentences
+    def write_document(self, ssf_document_object):
+        self.start_document(ssf_document_object)
+        for ssf_sentence_object in ssf_document_object.sentences():
+            self.write_sentence(ssf_sentence_object)
+        self.end_document()
+
+    # function to write the <document> tag of a document, the sentences are written with write_sentence and end_document closes it
+    def start_document(self, ssf_document_object):
+        self.end_document()
+        self.ssf_document = ssf_document_object
+        self.write_text("<document id='%s'>\n" % ssf_document_object.ssf_id)
+
+    # function to close the open document, if any
+    def end_document(self):
+        if self.ssf_document is not None:
+            self.ssf_document = None
+            self.write_text("</document>\n")
+
+    # function to write one sentence, in the open document if any
+    def write_sentence(self, ssf_sentence_object):
+        self.write_text("\n".join(ssf_sentence_lines(ssf_sentence_object)) + "\n")
+
+    # function to write what ssf_corpus.stream_file yields, with or without keep_sentences
+    # the sentences are written as soon as they come, so memory is bounded by one sentence (one document with keep_sentences=True)
+    def write_stream(self, ssf_stream):
+        for ssf_document_object, ssf_sentence_object in ssf_stream:
+            if ssf_sentence_object is not None:
+                if ssf_document_object is not self.ssf_document:
+                    self.start_document(ssf_document_object)
+                self.write_sentence(ssf_sentence_object)
+            elif ssf_document_object is self.ssf_document:
+                self.end_document()
+            # a complete document whose sentences were not written one by one
+            else:
+                self.write_document(ssf_document_object)
+        # a document left open at the end of the stream is closed, its sentences are written like iter_sentences() yields them
+        self.end_document()
+
+    # function to add text to the buffer, which is written once it is long enough
+    def write_text(self, ssf_text):
+        self.ssf_buffer.append(ssf_text)
+        self.ssf_buffer_length += len(ssf_text)
+        if self.ssf_buffer_length >= self.buffer_size:
+            self.flush()
+
+    # function to write the buffered text to the file handle
+    def flush(self):
+        self.file_handle.write("".join(self.ssf_buffer))
+        self.ssf_buffer = []
+        self.ssf_buffer_length = 0
+
+
+# class giving random access to the sentences of a corpus folder by their IDs, without loading the corpus
+# a sentence is found by its ID, its (document ID, sentence ID) or its (file, document ID, sentence ID), see locate_all
+# the byte offsets of the documents and sentences of every corpus file are kept in an index file in index_folder (see build_ssf_offset_index),
+# which is (re)built when it is missing or was made for another version of the corpus file, the index folder must not be the corpus folder
+# a sentence is parsed on demand from the memory mapped corpus file into a normal ssf_sentence object (with new dynamic IDs)
+# its parent is a ssf_document object standing for its document, which does not hold the other sentences
+# the index is the one of the corpus files as they were when it was made
+class ssf_sentence_index(object):
+
+    def __init__(self, ssf_corpus_folder, index_folder, mode="lax", compact=False, keep_alternatives=False):
+        self.path = os.path.abspath(ssf_corpus_folder)
+        self.mode = mode
+        self.compact = compact
+        self.keep_alternatives = keep_alternatives
+        # (file path, offset index) of every corpus file, and file path -> file number
+        self.ssf_file_indexes = []
+        self.ssf_file_numbers = {}
+        # key -> (file number, sentence number) of the sentence with that key, the keys being the sentence ID, (document ID, sentence ID)
+        # and (file number, document ID, sentence ID) of every sentence
+        self.ssf_sentence_locations = {}
+        # key -> locations of all the sentences with that key, only for the keys of more than one sentence
+        # e.g. in lax mode every document is "null_lax" and the sentence IDs usually start again in every file
+        self.ssf_ambiguous_locations = {}
+        for file_number, ssf_corpus_file_path in enumerate(self.file_paths()):
+            self.ssf_file_numbers[ssf_corpus_file_path] = file_number
+            ssf_index_key = ssf_cache_key(ssf_corpus_file_path, mode)
+            ssf_offset_index = read_ssf_cache(index_folder, ssf_index_key, ".index")
+            if ssf_offset_index is None:
+                ssf_offset_index = build_ssf_offset_index(ssf_corpus_file_path, mode)
+                write_ssf_cache(index_folder, ssf_index_key, ssf_offset_index, ".index")
+            self.ssf_file_indexes.append((ssf_corpus_file_path, ssf_offset_index))
+            document_ids, sentence_ids, sentence_documents = ssf_offset_index[0], ssf_offset_index[2], ssf_offset_index[4]
+            for sentence_number, ssf_sentence_id in enumerate(sentence_ids):
+                if ssf_sentence_id is not None:
+                    ssf_document_id = document_ids[sentence_documents[sentence_number]]
+                    for ssf_key in (ssf_sentence_id, (ssf_document_id, ssf_sentence_id), (file_number, ssf_document_id, ssf_sentence_id)):
+                        self.add_location(ssf_key, (file_number, sentence_number))
+        # memory maps of the corpus files and the documents standing for the documents of the sentences, made when first needed
+        self.ssf_file_maps = {}
+        self.ssf_index_documents = {}
+
+    file_paths = ssf_corpus.file_paths
+
+    # function to add the location of a sentence under one of its keys
+    def add_location(self, ssf_key, location):
+        if ssf_key in self.ssf_sentence_locations:
+            self.ssf_ambiguous_locations.setdefault(ssf_key, [self.ssf_sentence_locations[ssf_key]]).append(location)
+        else:
+            self.ssf_sentence_locations[ssf_key] = location
+
+    # function to return the (file number, sentence number) of every sentence with a key, in corpus order
+    # the key is a sentence ID, a (document ID, sentence ID) pair or a (file path or file number, document ID, sentence ID) triple
+    def locate_all(self, ssf_key):
+        if isinstance(ssf_key, tuple) and len(ssf_key) == 3 and isinstance(ssf_key[0], str):
+            file_number = self.ssf_file_numbers.get(os.path.abspath(ssf_key[0]))
+            if file_number is None:
+                return []
+            ssf_key = (file_number,) + ssf_key[1:]
+        if ssf_key in self.ssf_ambiguous_locations:
+            return list(self.ssf_ambiguous_locations[ssf_key])
+        if ssf_key in self.ssf_sentence_locations:
+            return [self.ssf_sentence_locations[ssf_key]]
+        return []
+
+    # function to return the (file number, sentence number) of the sentence with a key (see locate_all), None if there is no such sentence
+    # raises ValueError if more than one sentence has that key, e.g. a sentence ID found in several documents
+    def locate(self, ssf_key):
+        locations = self.locate_all(ssf_key)
+        if len(locations) > 1:
+            raise ValueError("%d sentences have the key %r, use a (file, document ID, sentence ID) key or locate_all" % (len(locations), ssf_key))
+        return locations[0] if len(locations) > 0 else None
+
+    # function to return the ssf_sentence object of the sentence with a key (see locate)
+    # returns None if there is no such sentence or if it is not valid, raises ValueError if more than one sentence has that key
+    def get_sentence(self, ssf_key):
+        return self.get_sentences([ssf_key])[0]
+
+    # function to return the ssf_sentence objects of several sentences, see get_sentence
+    # the sentences are parsed in file order, so that the reads of a batch are close together
+    def get_sentences(self, ssf_keys):
+        locations = [self.locate(ssf_key) for ssf_key in ssf_keys]
+        ssf_sentence_objects = {}
+        for location in sorted(set(location for location in locations if location is not None)):
+            ssf_sentence_objects[location] = self.parse_sentence(*location)
+        return [ssf_sentence_objects[location] if location is not None else None for location in locations]
+
+    # function to parse a sentence of a corpus file from its memory map, returns None if the sentence is not valid
+    def parse_sentence(self, file_number, sentence_number):
+        ssf_corpus_file_path, ssf_offset_index = self.ssf_file_indexes[file_number]
+        if file_number not in self.ssf_file_maps:
+            with open(ssf_corpus_file_path, "rb") as ssf_corpus_file_handle:
+                self.ssf_file_maps[file_number] = mmap.mmap(ssf_corpus_file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        start, end = ssf_offset_index[3][2 * sentence_number], ssf_offset_index[3][2 * sentence_number + 1]
+        document_number = ssf_offset_index[4][sentence_number]
+        if (file_number, document_number) not in self.ssf_index_documents:
+            ssf_document_object = ssf_document.__new__(ssf_document)
+            ssf_document_object.start_document(None, ssf_corpus_file_path, ssf_offset_index[0][document_number])
+            ssf_document_object.finish_document()
+            self.ssf_index_documents[(file_number, document_number)] = ssf_document_object
+        ssf_sentence_string = decode_ssf_bytes(self.ssf_file_maps[file_number][start:end])
+        return self.ssf_index_documents[(file_number, document_number)].add_sentence(ssf_sentence_string, keep=False, compact=self.compact, keep_alternatives=self.keep_alternatives)
+
+    # function to close the memory maps of the corpus files
+    def close(self):
+        for ssf_file_map in self.ssf_file_maps.values():
+            ssf_file_map.close()
+        self.ssf_file_maps = {}
+
+
+# class representing a corpus flattened into a table of integer coded token columns (NumPy arrays), one row per token in corpus order
+# the string columns are coded with one vocabulary (list of values) per column, -1 is used for missing values
+#   token_value, token_type and af_root ... af_key8: the token fields and its abbreviated features
+#   chunk_type and drel_label: the type and the drel label of the innermost chunk around the token
+#   drel_head: the row of the head token (see ssf_chunk_head) of the chunk referred to by that drel, -1 if there is none
+#   sentence and document: the index of the sentence and of the document of the token
+# sentence_offsets and document_offsets hold the first row of every sentence and document, followed by the number of rows
+# a table written with save() can be opened again with load_ssf_token_table() as memory mapped arrays, without any parsing
+class ssf_token_table(object):
+    coded_columns = ("token_value", "token_type") + tuple("af_" + name for name in ssf_abbreviated_feature_names) + ("chunk_type", "drel_label")
+    index_columns = ("drel_head", "sentence", "document", "sentence_offsets", "document_offsets")
+
+    def __init__(self, columns, vocabularies):
+        # column name -> array and coded column name -> list of values
+        self.columns = columns
+        self.vocabularies = vocabularies
+        # coded column name -> {value: code}, made when first needed
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.columns["token_value"])
+
+    # function to return the code of a value in a coded column, None if the value never occurs
+    def code(self, column, value):
+        if column not in self.codes:
+            self.codes[column] = dict((vocabulary_value, code) for code, vocabulary_value in enumerate(self.vocabularies[column]))
+        return self.codes[column].get(value)
+
+    # function to return the boolean mask of the rows which have value in a coded column
+    def mask(self, column, value):
+        code = self.code(column, value)
+        if code is None:
+            return numpy.zeros(len(self), dtype=bool)
+        return self.columns[column] == code
+
+    # function to turn codes of a coded column back into values, None for missing values
+    def decode(self, column, codes):
+        vocabulary = numpy.array(self.vocabularies[column] + [None], dtype=object)
+        # -1 picks the None at the end
+        return vocabulary[numpy.asarray(codes)]
+
+    # function to count the values of a coded column, for the rows selected by an optional boolean mask
+    # returns a dict of value -> count, missing values are counted under None
+    def value_counts(self, column, mask=None):
+        codes = self.columns[column] if mask is None else self.columns[column][mask]
+        # shift by one so that missing values (-1) are counted in bin 0
+        counts = numpy.bincount(codes + 1, minlength=len(self.vocabularies[column]) + 1)
+        values = [None] + self.vocabularies[column]
+        return dict((values[code], int(count)) for code, count in enumerate(counts) if count > 0)
+
+    # function to write the table to a folder, one .npy file per column and the vocabularies in vocabularies.json
+    def save(self, ssf_table_folder):
+        if not os.path.isdir(ssf_table_folder):
+            os.makedirs(ssf_table_folder)
+        for column, values in self.columns.items():
+            numpy.save(os.path.join(ssf_table_folder, column + ".npy"), values)
+        with open(os.path.join(ssf_table_folder, "vocabularies.json"), "w") as ssf_vocabularies_file_handle:
+            json.dump(self.vocabularies, ssf_vocabularies_file_handle)
+
+
+# function to open a table written by ssf_token_table.save(), the columns are memory mapped unless mmap_mode is None
+def load_ssf_token_table(ssf_table_folder, mmap_mode="r"):
+    if numpy is None:
+        raise ImportError("numpy is needed for the SSF token table")
+    with open(os.path.join(ssf_table_folder, "vocabularies.json"), "r") as ssf_vocabularies_file_handle:
+        vocabularies = json.load(ssf_vocabularies_file_handle)
+    columns = {}
+    for column in ssf_token_table.coded_columns + ssf_token_table.index_columns:
+        columns[column] = numpy.load(os.path.join(ssf_table_folder, column + ".npy"), mmap_mode=mmap_mode)
+    return ssf_token_table(columns, vocabularies)
+
+
+# generator over the (token, innermost chunk) pairs of a chunk, in token order
+def iter_tokens_with_chunks(ssf_chunk_object):
+    for element in ssf_chunk_object.ssf_tokens_and_chunks:
+        if isinstance(element, ssf_token_types):
+            yield element, ssf_chunk_object
+        else:
+            for token_and_chunk in iter_tokens_with_chunks(element):
+                yield token_and_chunk
+
+
+# function to flatten documents into a ssf_token_table
+def build_ssf_token_table(ssf_documents):
+    if numpy is None:
+        raise ImportError("numpy is needed for the SSF token table")
+    # value -> code of every coded column, and the codes and indexes of every row, in compact arrays until the end
+    codes = dict((column, {}) for column in ssf_token_table.coded_columns)
+    rows = dict((column, array.array("q")) for column in ssf_token_table.coded_columns + ssf_token_table.index_columns)
+    af_columns = [("af_" + name, name) for name in ssf_abbreviated_feature_names]
+    sentence_number = 0
+    document_number = 0
+    for ssf_document_object in ssf_documents:
+        rows["document_offsets"].append(len(rows["token_value"]))
+        for ssf_sentence_object in ssf_document_object.sentences():
+            first_row = len(rows["token_value"])
+            rows["sentence_offsets"].append(first_row)
+            # row of every token of the sentence, and the (row, chunk referred to) of every drel
+            token_rows = {}
+            drel_rows = []
+            for ssf_chunk_object in ssf_sentence_object.ssf_chunks:
+                for ssf_token_object, innermost_chunk in iter_tokens_with_chunks(ssf_chunk_object):
+                    row = len(rows["token_value"])
+                    token_rows[id(ssf_token_object)] = row
+                    rows["token_value"].append(codes["token_value"].setdefault(ssf_token_object.ssf_token_value, len(codes["token_value"])))
+                    rows["token_type"].append(codes["token_type"].setdefault(ssf_token_object.ssf_token_type, len(codes["token_type"])))
+                    abbreviated_features = ssf_token_object.ssf_feature_structure.get("af")
+                    for af_column, name in af_columns:
+                        if abbreviated_features is None:
+                            rows[af_column].append(-1)
+                        else:
+                            rows[af_column].append(codes[af_column].setdefault(abbreviated_features[name], len(codes[af_column])))
+                    rows["chunk_type"].append(codes["chunk_type"].setdefault(innermost_chunk.ssf_chunk_type, len(codes["chunk_type"])))
+                    drel = innermost_chunk.ssf_feature_structure.get("drel")
+                    if drel is None:
+                        rows["drel_label"].append(-1)
+                        rows["drel_head"].append(-1)
+                    else:
+                        # resolved by ssf_sentence as (label, chunk), the head row is found once the whole sentence is read
+                        drel_label, drel_chunk = drel if isinstance(drel, tuple) else (drel.split(":")[0], None)
+                        rows["drel_label"].append(codes["drel_label"].setdefault(drel_label, len(codes["drel_label"])))
+                        rows["drel_head"].append(-1)
+                        drel_rows.append((row, drel_chunk))
+                    rows["sentence"].append(sentence_number)
+                    rows["document"].append(document_number)
+            for row, drel_chunk in drel_rows:
+                drel_head = ssf_chunk_head(drel_chunk) if drel_chunk is not None else None
+                if drel_head is not None:
+                    rows["drel_head"][row] = token_rows.get(id(drel_head), -1)
+            sentence_number += 1
+        document_number += 1
+    rows["sentence_offsets"].append(len(rows["token_value"]))
+    rows["document_offsets"].append(len(rows["token_value"]))
+    columns = {}
+    for column, values in rows.items():
+        # the codes fit in 32 bits, the indexes are kept 64 bits wide
+        columns[column] = numpy.array(values, dtype=numpy.int32 if column in codes else numpy.int64)
+    vocabularies = {}
+    for column, column_codes in codes.items():
+        vocabularies[column] = sorted(column_codes, key=column_codes.get)
+    return ssf_token_table(columns, vocabularies)
+
+
+# function to compile an expected value of a query into a test on a value, None when anything is expected
+# the expected value is a string (equality), a function (called with the value) or a collection of strings (membership)
+def ssf_value_test(expected):
+    if expected is None:
+        return None
+    if isinstance(expected, str):
+        return lambda value: value == expected
+    if callable(expected):
+        return expected
+    return frozenset(expected).__contains__
+
+
+# function to combine the tests of a filter into one function, the tests are run in the given order until one fails
+def ssf_all_tests(tests):
+    if len(tests) == 0:
+        return lambda element: True
+    if len(tests) == 1:
+        return tests[0]
+    tests = tuple(tests)
+
+    def all_tests(element):
+        for test in tests:
+            if not test(element):
+                return False
+        return True
+    return all_tests
+
+
+# function to compile the tests on the feature structure of a token or a chunk, fs maps feature names to expected values (see ssf_value_test)
+# an expected value of None only checks that the feature is there, "af" and "drel" are tested with the af and drel arguments of the filters
+def ssf_feature_structure_tests(fs):
+    tests = []
+    for feature, expected in (fs or {}).items():
+        value_test = ssf_value_test(expected)
+        if value_test is None:
+            tests.append(lambda element, feature=feature: feature in element.ssf_feature_structure)
+        else:
+            tests.append(lambda element, feature=feature, value_test=value_test: feature in element.ssf_feature_structure and value_test(element.ssf_feature_structure[feature]))
+    return tests
+
+
+# function to compile a token filter, i.e. a function telling if a token matches all the given conditions
+# value and token_type are expected values of the token fields (see ssf_value_test), fs of its features and af of its abbreviated features by name
+# chunk is a chunk filter (see ssf_chunk_filter) the innermost chunk around the token has to match
+def ssf_token_filter(value=None, token_type=None, fs=None, af=None, chunk=None):
+    # the cheap tests on the token fields come first
+    tests = []
+    value_test = ssf_value_test(value)
+    if value_test is not None:
+        tests.append(lambda token: value_test(token.ssf_token_value))
+    token_type_test = ssf_value_test(token_type)
+    if token_type_test is not None:
+        tests.append(lambda token: token_type_test(token.ssf_token_type))
+    tests += ssf_feature_structure_tests(fs)
+    for name, expected in (af or {}).items():
+        if name not in ssf_abbreviated_feature_positions:
+            raise ValueError("unknown abbreviated feature %s, it is one of %s" % (name, ", ".join(ssf_abbreviated_feature_names)))
+        af_test = ssf_value_test(expected)
+        if af_test is not None:
+            tests.append(lambda token, name=name, af_test=af_test: "af" in token.ssf_feature_structure and af_test(token.ssf_feature_structure["af"][name]))
+    if chunk is not None:
+        tests.append(lambda token: isinstance(token.parent, ssf_chunk_types) and chunk(token.parent))
+    return ssf_all_tests(tests)
+
+
+# function to return the head token of a chunk, i.e. the token of its own whose "name" is the "head" feature of the chunk, None if there is none
+# BEWARE without a "head" feature, the last token of its own (not in a nested chunk) is taken as the head of the chunk
+def ssf_chunk_head(ssf_chunk_object):
+    head_name = ssf_chunk_object.ssf_feature_structure.get("head")
+    head_token = None
+    for element in ssf_chunk_object.ssf_tokens_and_chunks:
+        if isinstance(element, ssf_token_types):
+            if head_name is None:
+                head_token = element
+            elif element.ssf_feature_structure.get("name") == head_name:
+                return element
+    return head_token
+
+
+# function to compile a chunk filter, i.e. a function telling if a chunk matches all the given conditions
+# chunk_type is an expected value of the chunk type (see ssf_value_test) and fs of its features
+# drel is an expected value of the label of its "drel" and drel_target a chunk filter the chunk referred to by the "drel" has to match
+# head is a token filter (see ssf_token_filter) its head token has to match (see ssf_chunk_head) and any_token one that any of its tokens has to match
+def ssf_chunk_filter(chunk_type=None, fs=None, drel=None, drel_target=None, head=None, any_token=None):
+    # from the cheapest to the most expensive test
+    tests = []
+    chunk_type_test = ssf_value_test(chunk_type)
+    if chunk_type_test is not None:
+        tests.append(lambda chunk: chunk_type_test(chunk.ssf_chunk_type))
+    tests += ssf_feature_structure_tests(fs)
+    drel_test = ssf_value_test(drel)
+    if drel_test is not None or drel_target is not None:
+        def relation_test(chunk):
+            relation = chunk.ssf_feature_structure.get("drel")
+            if relation is None:
+                return False
+            # resolved by ssf_sentence as (label, chunk) through its ssf_chunk_names index
+            if not isinstance(relation, tuple):
+                relation = (relation.split(":")[0], None)
+            if drel_test is not None and not drel_test(relation[0]):
+                return False
+            return drel_target is None or (relation[1] is not None and drel_target(relation[1]))
+        tests.append(relation_test)
+    if head is not None:
+        def head_test(chunk):
+            head_token = ssf_chunk_head(chunk)
+            return head_token is not None and head(head_token)
+        tests.append(head_test)
+    if any_token is not None:
+        tests.append(lambda chunk: any(any_token(token) for token in chunk.iter_tokens()))
+    return ssf_all_tests(tests)
+
+
+# class representing a compiled query, which selects the chunks (target="chunk") or the tokens (target="token") matching a filter
+# match is a filter made by ssf_chunk_filter or ssf_token_filter (or any function taking a chunk or a token), and mode the chunks looked at (see ssf_sentence.chunks)
+# e.g. the NP chunks with a "k1" drel whose head token has "af" case "o":
+#   ssf_query("chunk", ssf_chunk_filter(chunk_type="NP", drel="k1", head=ssf_token_filter(af={"case": "o"})))
+class ssf_query(object):
+
+    def __init__(self, target="chunk", match=None, mode="all"):
+        if target != "chunk" and target != "token":
+            raise ValueError("the target of a query is \"chunk\" or \"token\", not %s" % target)
+        self.target = target
+        self.match = match if match is not None else ssf_all_tests([])
+        self.mode = mode
+
+    # generator over the matching chunks or tokens of a source, in corpus order, in a single pass
+    # the source is a ssf_corpus (a lazy one is streamed), a document, a sentence, or an iterable of documents, sentences or of what ssf_corpus.stream_file yields
+    # the cached views of a sentence (see ssf_sentence.cached_views) are used when they are already built
+    def run(self, ssf_source):
+        match = self.match
+        for ssf_sentence_object in iter_ssf_source_sentences(ssf_source):
+            if self.target == "chunk":
+                if ssf_sentence_object.ssf_cached_views is not None:
+                    elements = ssf_sentence_object.cached_chunks(self.mode)
+                else:
+                    elements = ssf_sentence_object.iter_chunks(self.mode)
+            elif ssf_sentence_object.ssf_cached_views is not None:
+                elements = ssf_sentence_object.cached_tokens()
+            else:
+                elements = ssf_sentence_object.iter_tokens()
+            for element in elements:
+                if match(element):
+                    yield element
+
+    # function to return the number of matching chunks or tokens of a source
+    def count(self, ssf_source):
+        return sum(1 for element in self.run(ssf_source))
+
+
+# generator over the sentences of a query source, see ssf_query.run
+def iter_ssf_source_sentences(ssf_source):
+    if isinstance(ssf_source, ssf_corpus):
+        ssf_source = ssf_source.iter_sentences()
+    elif isinstance(ssf_source, (ssf_document, ssf_sentence)):
+        ssf_source = [ssf_source]
+    for item in ssf_source:
+        if isinstance(item, ssf_sentence):
+            yield item
+        elif isinstance(item, ssf_document):
+            for ssf_sentence_object in item.sentences():
+                yield ssf_sentence_object
+        # (document, sentence) from ssf_corpus.stream_file, the (document, None) of a complete document comes after its sentences
+        elif item[1] is not None:
+            yield item[1]
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Regression tests of process_ssf, run with "python -m unittest test_process_ssf" (or pytest).
+Distributed under the same license as process_ssf, the GNU General Public License version 3 or (at your option) any later version.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import process_ssf
+from benchmark_ssf import generate_ssf_corpus
+
+
+# function to return every ID of a corpus: the (document ID, sentence IDs) and for every sentence its (chunk ID, token IDs, drel target chunk ID)
+def ssf_corpus_ids(ssf_corpus_object):
+    ssf_ids = []
+    for ssf_document_object in ssf_corpus_object.documents():
+        ssf_ids.append((ssf_document_object.id, ssf_document_object.ssf_id))
+        for ssf_sentence_object in ssf_document_object.sentences():
+            ssf_chunk_ids = []
+            for ssf_chunk_object in ssf_sentence_object.iter_chunks(mode="all"):
+                drel = ssf_chunk_object.ssf_feature_structure.get("drel")
+                ssf_chunk_ids.append((ssf_chunk_object.id, [ssf_token_object.id for ssf_token_object in ssf_chunk_object.iter_tokens()], drel[1].id if drel is not None else None))
+            ssf_ids.append((ssf_sentence_object.id, ssf_sentence_object.ssf_id, ssf_chunk_ids))
+    return ssf_ids
+
+
+class ssf_corpus_id_test(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.corpus_folder = os.path.join(self.folder, "corpus")
+        self.cache_folder = os.path.join(self.folder, "cache")
+        generate_ssf_corpus(self.corpus_folder, files=3, sentences=90, documents_per_file=4)
+        self.parallel_part_size = process_ssf.ssf_corpus.parallel_part_size
+        # small parts, so that the files are also cut into several parts for the workers
+        process_ssf.ssf_corpus.parallel_part_size = 4 * 1024
+
+    def tearDown(self):
+        process_ssf.ssf_corpus.parallel_part_size = self.parallel_part_size
+        shutil.rmtree(self.folder)
+
+    # function to load the corpus with the ID counters starting at first_ids and return all its IDs
+    def load_ids(self, first_ids=(0, 0, 0, 0), **options):
+        process_ssf.set_ssf_ids(first_ids)
+        return ssf_corpus_ids(process_ssf.ssf_corpus(self.corpus_folder, mode="strict", **options))
+
+    def test_serial_parallel_and_cached_loads_have_the_same_ids(self):
+        for first_ids in ((0, 0, 0, 0), (7, 5, 3, 2)):
+            serial_ids = self.load_ids(first_ids)
+            self.assertEqual(self.load_ids(first_ids, workers=2), serial_ids)
+            # cold cache, then warm cache with the IDs counted from other first IDs than the ones stored in the cache files
+            self.assertEqual(self.load_ids(first_ids, cache_folder=self.cache_folder), serial_ids)
+            self.assertEqual(self.load_ids(first_ids, cache_folder=self.cache_folder), serial_ids)
+            self.assertEqual(self.load_ids(first_ids, workers=2, cache_folder=self.cache_folder), serial_ids)
+
+    def test_partly_cached_load_has_the_same_ids(self):
+        self.load_ids(cache_folder=self.cache_folder)
+        # the cache of the second file is outdated, so it is parsed again between two cached files
+        ssf_corpus_file_path = os.path.join(self.corpus_folder, "part001.ssf")
+        ssf_corpus_file_stat = os.stat(ssf_corpus_file_path)
+        os.utime(ssf_corpus_file_path, ns=(ssf_corpus_file_stat.st_atime_ns, ssf_corpus_file_stat.st_mtime_ns + 10 ** 9))
+        serial_ids = self.load_ids((3, 2, 1, 1))
+        self.assertEqual(self.load_ids((3, 2, 1, 1), workers=2, cache_folder=self.cache_folder), serial_ids)
+        self.assertEqual(self.load_ids((3, 2, 1, 1), cache_folder=self.cache_folder), serial_ids)
+
+    def test_compact_cached_load_has_the_same_ids(self):
+        serial_ids = self.load_ids(compact=True)
+        self.assertEqual(self.load_ids(compact=True, cache_folder=self.cache_folder), serial_ids)
+        self.assertEqual(self.load_ids(compact=True, cache_folder=self.cache_folder), serial_ids)
+
+
+if __name__ == "__main__":
+    unittest.main()